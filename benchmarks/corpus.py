@@ -0,0 +1,196 @@
+"""
+Synthetic content for the liquid tags benchmarks.
+
+``generate`` writes a Pelican content directory with a configurable number of
+Markdown articles, each containing a configurable number of liquid tags drawn
+from a weighted tag mix, together with the code files and notebooks those
+tags include.
+"""
+import base64
+import json
+import os
+import random
+
+# tag name -> relative weight in the default mix
+DEFAULT_MIX = {
+    "img": 4,
+    "youtube": 2,
+    "vimeo": 1,
+    "literal": 1,
+    "include_code": 2,
+    "flickr": 1,
+    "giphy": 1,
+    "soundcloud": 1,
+    "notebook": 1,
+}
+
+# tags whose rendering goes to the network
+NETWORK_TAGS = {"flickr", "giphy", "soundcloud", "gram"}
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua"
+).split()
+
+CODE_FILES = 8
+NOTEBOOKS = 2
+NOTEBOOK_CELLS = 60
+
+
+def parse_mix(text):
+    """Parse ``"img:4,notebook:1"`` into a tag mix"""
+    mix = {}
+    for item in text.split(","):
+        tag, _, weight = item.partition(":")
+        mix[tag.strip()] = float(weight or 1)
+    return mix
+
+
+def paragraph(rng, words=60):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_tag(tag, rng, serial):
+    """Return the markup of one tag of the given kind"""
+    if tag == "img":
+        return "{%% img /images/pic-%d.png 300 200 'Picture %d' %%}" % (serial, serial)
+    if tag == "youtube":
+        return "{%% youtube vid%08d 640 480 %%}" % serial
+    if tag == "vimeo":
+        return "{%% vimeo %d 640 480 %%}" % (10000000 + serial)
+    if tag == "literal":
+        return "{%% literal img /images/raw-%d.png %%}" % serial
+    if tag == "include_code":
+        first = rng.randint(1, 150)
+        return "{%% include_code snippet-%d.py lang:python lines:%d-%d %%}" % (
+            serial % CODE_FILES,
+            first,
+            first + 20,
+        )
+    if tag == "flickr":
+        return "{%% flickr %d large %%}" % (18000000000 + serial)
+    if tag == "giphy":
+        return "{%% giphy gif%06d %%}" % serial
+    if tag == "soundcloud":
+        return "{%% soundcloud https://soundcloud.com/bench/track-%d %%}" % serial
+    if tag == "gram":
+        return "{%% gram code%06d m %%}" % serial
+    if tag == "notebook":
+        start = rng.randint(0, NOTEBOOK_CELLS - 10)
+        return "{%% notebook bench-%d.ipynb cells[%d:%d] %%}" % (
+            serial % NOTEBOOKS,
+            start,
+            start + 8,
+        )
+    raise ValueError(f"No generator for tag '{tag}'")
+
+
+def write_code(directory):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(CODE_FILES):
+        with open(os.path.join(directory, f"snippet-{i}.py"), "w") as fh:
+            for line in range(200):
+                fh.write(f"def function_{i}_{line}(x):\n    return x * {line}\n\n")
+
+
+def image_output(rng, nbytes):
+    """A display_data output carrying ``nbytes`` of (fake) PNG data"""
+    if not nbytes:
+        return []
+    # Random.randbytes is Python 3.9+
+    data = rng.getrandbits(8 * nbytes).to_bytes(nbytes, "little")
+    data = base64.b64encode(data).decode("ascii")
+    return [
+        {
+            "output_type": "display_data",
+            "metadata": {},
+            "data": {"image/png": data, "text/plain": "<Figure>"},
+        }
+    ]
+
+
+def write_notebooks(directory, rng, output_bytes=0):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(NOTEBOOKS):
+        cells = []
+        for n in range(NOTEBOOK_CELLS):
+            if n % 3 == 0:
+                cells.append(
+                    {
+                        "cell_type": "markdown",
+                        "metadata": {},
+                        "source": "## Section %d\n\n%s" % (n, paragraph(rng, 30)),
+                    }
+                )
+            else:
+                cells.append(
+                    {
+                        "cell_type": "code",
+                        "execution_count": n,
+                        "metadata": {},
+                        "source": "values = [x ** 2 for x in range(%d)]\n"
+                        "print(sum(values))" % n,
+                        "outputs": [
+                            {
+                                "name": "stdout",
+                                "output_type": "stream",
+                                "text": "%d\n" % sum(x**2 for x in range(n)),
+                            }
+                        ]
+                        + image_output(rng, output_bytes),
+                    }
+                )
+        notebook = {
+            "cells": cells,
+            "metadata": {
+                "kernelspec": {
+                    "display_name": "Python 3",
+                    "language": "python",
+                    "name": "python3",
+                },
+                "language_info": {"name": "python"},
+            },
+            "nbformat": 4,
+            "nbformat_minor": 4,
+        }
+        with open(os.path.join(directory, f"bench-{i}.ipynb"), "w") as fh:
+            json.dump(notebook, fh, indent=1)
+
+
+def generate(
+    path, articles=100, tags_per_article=10, mix=None, seed=0, notebook_output=0
+):
+    """Write a synthetic content tree to ``path``; return the list of sources
+
+    ``notebook_output`` is the size in bytes of the image output attached to
+    each code cell of the notebooks.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    tags, weights = zip(*mix.items())
+
+    content = os.path.join(path, "content")
+    os.makedirs(content, exist_ok=True)
+    if "include_code" in mix:
+        write_code(os.path.join(content, "code"))
+    if "notebook" in mix:
+        write_notebooks(os.path.join(content, "notebooks"), rng, notebook_output)
+
+    sources = []
+    serial = 0
+    for n in range(articles):
+        body = [
+            "Title: Benchmark article %d" % n,
+            "Date: 2020-01-01 00:%02d" % (n % 60),
+            "Category: benchmark",
+            "Slug: article-%05d" % n,
+            "",
+        ]
+        for tag in rng.choices(tags, weights, k=tags_per_article):
+            serial += 1
+            body += [paragraph(rng), "", make_tag(tag, rng, serial), ""]
+        source = os.path.join(content, "article-%05d.md" % n)
+        with open(source, "w") as fh:
+            fh.write("\n".join(body))
+        sources.append(source)
+    return sources
@@ -0,0 +1,294 @@
+"""
+Throughput benchmark for the liquid tags pipeline.
+
+Generates a synthetic corpus (see ``corpus.py``), serves the network tags
+from a local stand-in server (see ``servers.py``) and measures:
+
+* the throughput of the Markdown preprocessor over all articles,
+* the time of a full Pelican build of the corpus,
+* the peak Python memory of both (with tracemalloc, in separate runs),
+* the latency of each tag, as recorded by the plugin's tag statistics.
+
+Results are written as JSON to ``benchmarks/results``, named after the
+current commit, and can be compared with ``--compare``::
+
+    python benchmarks/run.py --articles 200 --tags 12 --latency 50
+    python benchmarks/run.py --set LIQUID_TAGS_THREADS=8
+    python benchmarks/run.py --mix notebook:1 --notebook-output 512
+    python benchmarks/run.py --compare results/a.json results/b.json
+"""
+import argparse
+import ast
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import markdown
+
+from pelican import Pelican
+from pelican.plugins.liquid_tags.mdx_liquid_tags import (
+    LT_CONFIG,
+    TAG_MODULES,
+    LiquidTags,
+    current_source,
+)
+from pelican.settings import read_settings
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import corpus  # noqa: E402
+import servers  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+        dirty = bool(
+            subprocess.check_output(["git", "status", "--porcelain", "-uno"], text=True)
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+@contextlib.contextmanager
+def peak_memory(result, key):
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        result[key] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+
+def preprocess_all(sources, settings):
+    """Run the preprocessor over every source; return the extension"""
+    configs = dict(LT_CONFIG)
+    configs.update({k: v for k, v in settings.items() if k in LT_CONFIG})
+    extension = LiquidTags(configs)
+    md = markdown.Markdown(extensions=[extension])
+    preprocessor = md.preprocessors["mdincludes"]
+    for source in sources:
+        with open(source, encoding="utf-8") as fh:
+            lines = fh.read().split("\n")
+        md.htmlStash.reset()
+        token = current_source.set(source)
+        try:
+            preprocessor.run(lines)
+        finally:
+            current_source.reset(token)
+    return extension
+
+
+def bench_preprocessor(sources, settings, repeat, memory):
+    times = []
+    extension = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        extension = preprocess_all(sources, settings)
+        times.append(time.perf_counter() - started)
+    result = {"seconds_min": min(times), "seconds_mean": sum(times) / len(times)}
+    nbytes = sum(os.path.getsize(source) for source in sources)
+    result["articles_per_second"] = len(sources) / result["seconds_min"]
+    result["mb_per_second"] = nbytes / result["seconds_min"] / 1e6
+    if memory:
+        with peak_memory(result, "peak_memory"):
+            preprocess_all(sources, settings)
+    return result, extension.tag_stats().report()["tags"]
+
+
+def build(root, settings):
+    output = tempfile.mkdtemp(prefix="output.", dir=root)
+    overrides = {
+        "PATH": os.path.join(root, "content"),
+        "OUTPUT_PATH": output,
+        "CACHE_PATH": os.path.join(root, "cache"),
+        "PLUGINS": ["liquid_tags"],
+        "FEED_ALL_ATOM": None,
+        "CATEGORY_FEED_ATOM": None,
+        "AUTHOR_FEED_ATOM": None,
+        "AUTHOR_FEED_RSS": None,
+        "TRANSLATION_FEED_ATOM": None,
+    }
+    overrides.update(settings)
+    pelican = Pelican(read_settings(override=overrides))
+    started = time.perf_counter()
+    pelican.run()
+    elapsed = time.perf_counter() - started
+    shutil.rmtree(output)
+    return elapsed
+
+
+def bench_build(root, settings, memory):
+    result = {"seconds": build(root, settings)}
+    if memory:
+        with peak_memory(result, "peak_memory"):
+            build(root, settings)
+    return result
+
+
+def run(args):
+    mix = corpus.parse_mix(args.mix) if args.mix else corpus.DEFAULT_MIX
+    settings = {
+        "LIQUID_TAGS": sorted({TAG_MODULES[tag] for tag in mix}),
+        "LIQUID_TAGS_STATS": True,
+        "FLICKR_API_KEY": "benchmark",
+        "GIPHY_API_KEY": "benchmark",
+    }
+    for item in args.set:
+        key, _, value = item.partition("=")
+        try:
+            settings[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            settings[key] = value
+
+    root = tempfile.mkdtemp(prefix="liquid-tags-bench.")
+    cwd = os.getcwd()
+    try:
+        sources = corpus.generate(
+            root,
+            args.articles,
+            args.tags,
+            mix,
+            args.seed,
+            notebook_output=args.notebook_output * 1024,
+        )
+        # include_code resolves paths relative to the working directory
+        os.chdir(root)
+        for module in settings["LIQUID_TAGS"]:
+            LiquidTags.register_lazy(module)
+        with servers.StandInServer(args.latency / 1000) as server:
+            servers.redirect_tags(server)
+            preprocessor, tags = bench_preprocessor(
+                sources, settings, args.repeat, not args.no_memory
+            )
+            result = {"preprocessor": preprocessor, "tags": tags}
+            if not args.no_build:
+                result["build"] = bench_build(root, settings, not args.no_memory)
+            result["network_requests"] = server.requests
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+    commit, dirty = git_revision()
+    result.update(
+        commit=commit,
+        dirty=dirty,
+        timestamp=datetime.datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        params={
+            "articles": args.articles,
+            "tags_per_article": args.tags,
+            "mix": mix,
+            "latency_ms": args.latency,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "notebook_output_kb": args.notebook_output,
+        },
+        settings={k: v for k, v in settings.items() if k != "LIQUID_TAGS"},
+    )
+    return result
+
+
+def flatten(result, prefix=""):
+    """Yield ``(name, value)`` for the numeric leaves of a result"""
+    for key, value in result.items():
+        if key in ("params", "settings"):
+            continue
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def print_result(result):
+    print(f"\ncommit {result['commit']}{' (dirty)' if result['dirty'] else ''}")
+    for name, value in flatten(result):
+        print(f"  {name:<45} {value:>14.6g}")
+
+
+def compare(paths):
+    results = []
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            results.append(json.load(fh))
+    base = dict(flatten(results[0]))
+    header = "".join(f"{r['commit']:>18}" for r in results)
+    print(f"{'':<45}{header}")
+    for name, value in base.items():
+        cells = [f"{value:>18.6g}"]
+        for other in results[1:]:
+            new = dict(flatten(other)).get(name)
+            if new is None:
+                cells.append(f"{'-':>18}")
+            elif value:
+                cells.append(f"{new:>12.6g} x{new / value:4.2f}")
+            else:
+                cells.append(f"{new:>18.6g}")
+        print(f"{name:<45}" + "".join(cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--articles", type=int, default=100)
+    parser.add_argument("--tags", type=int, default=10, help="tags per article")
+    parser.add_argument(
+        "--mix", help="weighted tag mix, e.g. 'img:4,flickr:1' (default: all)"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=50, help="stand-in server latency in ms"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--notebook-output",
+        type=int,
+        default=0,
+        metavar="KB",
+        help="size of the image output of each notebook code cell",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Pelican setting to apply, e.g. LIQUID_TAGS_THREADS=8",
+    )
+    parser.add_argument("--no-build", action="store_true")
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", default=RESULTS_DIR)
+    parser.add_argument("--compare", nargs="+", metavar="RESULT")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run(args)
+    print_result(result)
+
+    os.makedirs(args.output, exist_ok=True)
+    name = "{}-{}.json".format(result["commit"], result["timestamp"].replace(":", ""))
+    path = os.path.join(args.output, name)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(result, fh, indent=2)
+    print(f"\nResults written to {path}")
+
+
+if __name__ == "__main__":
+    main()
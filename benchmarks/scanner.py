@@ -0,0 +1,79 @@
+"""
+Worst-case benchmark for the liquid tag delimiter scanner.
+
+Pages full of ``{%`` that are never closed used to make the
+``LIQUID_TAG`` regular expression rescan to the end of the page for
+every opening delimiter.  This script times the scanner used by the
+Markdown preprocessor against that regular expression on inputs of
+doubling size.  For a linear scanner the time ratio between two
+consecutive sizes stays close to 2; for the regular expression it
+approaches 4.
+
+Run with::
+
+    python benchmarks/scanner.py
+"""
+import argparse
+import logging
+import timeit
+
+from pelican.plugins.liquid_tags.mdx_liquid_tags import LIQUID_TAG, _iter_segments
+
+CASES = {
+    # every opening delimiter is unterminated
+    "unterminated": "{% x ",
+    # Jinja snippets in code samples: closed braces, stray openers
+    "jinja": "{{ value }} {% if",
+    # well-formed tags, for reference
+    "closed": "text {% x y %} ",
+}
+
+
+def scanner(page):
+    return sum(1 for _ in _iter_segments(page))
+
+
+def regex(page):
+    return sum(1 for _ in LIQUID_TAG.finditer(page))
+
+
+def bench(func, page, repeat):
+    return min(timeit.repeat(lambda: func(page), number=1, repeat=repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, default=5, help="number of doublings")
+    parser.add_argument("--start", type=int, default=500, help="initial repetitions")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--no-regex", action="store_true", help="only time the linear scanner"
+    )
+    args = parser.parse_args(argv)
+    # the scanner reports each unterminated page; keep the table readable
+    logging.disable(logging.WARNING)
+
+    funcs = {"scanner": scanner}
+    if not args.no_regex:
+        funcs["regex"] = regex
+
+    for case, unit in CASES.items():
+        print(f"\n{case}")
+        print(f"{'bytes':>10} " + " ".join(f"{n:>18}" for n in funcs))
+        previous = {}
+        for i in range(args.sizes):
+            page = unit * (args.start * 2**i)
+            cells = []
+            for name, func in funcs.items():
+                elapsed = bench(func, page, args.repeat)
+                ratio = elapsed / previous[name] if name in previous else None
+                previous[name] = elapsed
+                cells.append(
+                    f"{elapsed * 1e3:9.3f}ms"
+                    + (f" x{ratio:4.1f}" if ratio is not None else "      ")
+                )
+            print(f"{len(page):>10} " + " ".join(f"{c:>18}" for c in cells))
+
+
+if __name__ == "__main__":
+    main()
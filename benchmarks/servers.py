@@ -0,0 +1,94 @@
+"""
+Local stand-ins for the web services used by the network tags.
+
+``StandInServer`` answers Flickr, Giphy, Soundcloud and Instagram requests
+from canned responses after a configurable latency. ``redirect_tags`` points
+the ``urlopen`` used by each network tag module at it, so that benchmarks
+measure the plugin rather than the internet.
+"""
+import http.server
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import urllib.request
+
+TEST_DATA = os.path.join(
+    os.path.dirname(__file__), "..", "pelican", "plugins", "liquid_tags", "test_data"
+)
+
+
+def _read(name):
+    with open(os.path.join(TEST_DATA, name), "rb") as fh:
+        return fh.read()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self._respond()
+
+    def _respond(self):
+        time.sleep(self.server.latency)
+        host = self.path.split("/")[1]
+        if host == "api.flickr.com":
+            body, kind = self.server.flickr, "application/json"
+        elif host == "api.giphy.com":
+            body, kind = self.server.giphy, "application/json"
+        elif host == "soundcloud.com":
+            html = '<iframe src="https://w.soundcloud.com/player/"></iframe>'
+            body, kind = json.dumps({"html": html}).encode(), "application/json"
+        else:
+            body, kind = b"\x89PNG\r\n\x1a\n", "image/png"
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.05):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.requests = 0
+        self.flickr = _read("flickr.json")
+        self.giphy = _read("giphy.json")
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def redirect_tags(server):
+    """Send the requests of the network tag modules to ``server``"""
+    from pelican.plugins.liquid_tags import flickr, giphy, gram, soundcloud
+
+    def urlopen(url, data=None, *args, **kwargs):
+        parts = urlsplit(url)
+        local = f"{server.url}/{parts.netloc}{parts.path}"
+        if parts.query:
+            local += "?" + parts.query
+        return urllib.request.urlopen(local, data, *args, **kwargs)
+
+    for module in (flickr, giphy, gram, soundcloud):
+        module.urlopen = urlopen
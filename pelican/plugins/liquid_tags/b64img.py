@@ -30,7 +30,7 @@ try:
 except ImportError:
     import urllib2
 
-from .mdx_liquid_tags import LiquidTags
+from .mdx_liquid_tags import LiquidTags, add_dependency, to_thread
 
 SYNTAX = '{% b64img [class name(s)] [http[s]:/]/path/to/image [width [height]] [title text | "title text" ["alt text"]] %}'
 
@@ -52,6 +52,7 @@ def _get_file(src):
             response = urllib2.urlopen(src)
             return response.read()
         else:
+            add_dependency(src)
             with open(src, "rb") as fh:
                 return fh.read()
     except Exception as e:
@@ -64,7 +65,7 @@ def base64image(src):
 
 
 @LiquidTags.register("b64img")
-def b64img(preprocessor, tag, markup):
+async def b64img(preprocessor, tag, markup):
     attrs = None
 
     # Parse the markup string
@@ -84,7 +85,7 @@ def b64img(preprocessor, tag, markup):
         if not attrs.get("alt"):
             attrs["alt"] = attrs["title"]
 
-    attrs["src"] = "data:;base64,{}".format(base64image(attrs["src"]))
+    attrs["src"] = "data:;base64,{}".format(await to_thread(base64image, attrs["src"]))
 
     # Return the formatted text
     return "<img {}>".format(" ".join(f'{key}="{val}"' for (key, val) in attrs.items()))
@@ -0,0 +1,193 @@
+"""
+Render Cache
+------------
+A persistent, content-addressed store for rendered tag output, kept under
+Pelican's ``CACHE_PATH`` so that unchanged tags are not rendered again on the
+next run.  Enable it in the settings file:
+
+    LIQUID_TAGS_CACHE = True
+
+Entries are keyed on the tag name, its markup, the liquid tags configuration
+and a fingerprint of the module implementing the handler, which covers the
+versions of the packages the output depends on.  Files a handler
+reports through ``add_dependency`` are hashed when the entry is written and
+checked again before it is reused.
+
+The cache is bounded by ``LIQUID_TAGS_CACHE_MAX_SIZE`` (bytes) and
+``LIQUID_TAGS_CACHE_MAX_ENTRIES``; the least recently used entries are
+evicted first.
+"""
+from collections import OrderedDict
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+try:
+    from importlib import metadata
+except ImportError:  # Python 3.7
+    try:
+        import importlib_metadata as metadata
+    except ImportError:
+        metadata = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "liquid_tags"
+
+# distributions whose upgrade may change the output of any tag
+DEPENDENCIES = ("pelican-liquid-tags", "pelican", "markdown", "pygments")
+
+_fingerprints = {}
+_digests = {}
+
+
+def distribution_versions(*names):
+    """Return the installed versions of the distributions ``names``"""
+    versions = []
+    for name in names:
+        try:
+            versions.append(metadata.version(name))
+        except Exception:
+            versions.append(None)
+    return versions
+
+
+def handler_fingerprint(func):
+    """Hash of the source of the module implementing ``func``
+
+    It also covers the versions of ``DEPENDENCIES``, and the value of the
+    ``cache_fingerprint()`` function of the module, if it has one, for
+    the other files and packages the output of its tags depends on.
+    """
+    try:
+        return _fingerprints[func]
+    except KeyError:
+        pass
+    digest = hashlib.sha256(func.__qualname__.encode())
+    try:
+        with open(inspect.getsourcefile(func), "rb") as fh:
+            digest.update(fh.read())
+    except (OSError, TypeError):
+        digest.update(func.__code__.co_code)
+    digest.update(repr(distribution_versions(*DEPENDENCIES)).encode())
+    module = inspect.getmodule(func)
+    fingerprint = getattr(module, "cache_fingerprint", None)
+    if fingerprint is not None:
+        digest.update(repr(fingerprint()).encode())
+    _fingerprints[func] = digest.hexdigest()
+    return _fingerprints[func]
+
+
+def tree_signature(*roots):
+    """Return the paths, modification times and sizes of the files in ``roots``"""
+    files = []
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, stat.st_mtime_ns, stat.st_size))
+    return files
+
+
+def file_digest(path):
+    """Hash of the contents of ``path``, or None if it cannot be read
+
+    Digests are remembered for the lifetime of the process as long as the
+    modification time and size of the file do not change.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (path, stat.st_mtime_ns, stat.st_size)
+    if signature not in _digests:
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+        _digests[signature] = digest.hexdigest()
+    return _digests[signature]
+
+
+def make_key(*parts):
+    """Return a stable hex key for a tuple of repr()-able values"""
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+class TagCache:
+    """An on-disk key/value store with least-recently-used eviction"""
+
+    def __init__(self, path, max_size, max_entries):
+        self.path = path
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._size = 0
+        os.makedirs(path, exist_ok=True)
+
+        entries = []
+        for entry in os.scandir(path):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._size += size
+
+    def get(self, key):
+        """Return the value stored under ``key``, or None"""
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        filename = os.path.join(self.path, key)
+        try:
+            with open(filename, "rb") as fh:
+                value = pickle.load(fh)
+            # the modification time doubles as the access time between runs
+            os.utime(filename)
+        except Exception as e:
+            logger.debug("Discarding unreadable cache entry %s: %s", key, e)
+            self._discard(key)
+            return None
+        return value
+
+    def set(self, key, value):
+        """Store ``value`` under ``key`` and evict entries over the limits"""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_size:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, os.path.join(self.path, key))
+        with self._lock:
+            self._size += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            while self._index and (
+                self._size > self.max_size or len(self._index) > self.max_entries
+            ):
+                old, size = self._index.popitem(last=False)
+                self._size -= size
+                self._remove(old)
+
+    def _discard(self, key):
+        with self._lock:
+            self._size -= self._index.pop(key, 0)
+        self._remove(key)
+
+    def _remove(self, key):
+        try:
+            os.remove(os.path.join(self.path, key))
+        except OSError:
+            pass
@@ -28,7 +28,8 @@ try:
 except ImportError:
     from urllib import urlopen, urlencode
 
-from .mdx_liquid_tags import LiquidTags
+from .mdx_liquid_tags import LiquidTags, to_thread
+from .prefetch import prefetcher, remote
 
 SYNTAX = """{% flickr image_id [small|medium|large] ["alt text"|'alt text'] %}"""
 PARSE_SYNTAX = re.compile(
@@ -38,6 +39,7 @@ PARSE_SYNTAX = re.compile(
 )
 
 
+@remote
 def get_info(photo_id, api_key):
     """Get photo informations from flickr api."""
     query = urlencode(
@@ -100,8 +102,16 @@ def generate_html(attrs, api_key):
     )
 
 
+@prefetcher("flickr")
+def prefetch_flickr(configs, markup):
+    match = PARSE_SYNTAX.search(markup)
+    if match:
+        photo_id = match.group("photo_id").strip()
+        yield get_info, (photo_id, configs.getConfig("FLICKR_API_KEY"))
+
+
 @LiquidTags.register("flickr")
-def flickr(preprocessor, tag, markup):
+async def flickr(preprocessor, tag, markup):
     # getting flickr api key out of config
     api_key = preprocessor.configs.getConfig("FLICKR_API_KEY")
 
@@ -118,7 +128,7 @@ def flickr(preprocessor, tag, markup):
             "Error processing input. " "Expected syntax: {}".format(SYNTAX)
         )
 
-    return generate_html(attrs, api_key)
+    return await to_thread(generate_html, attrs, api_key)
 
 
 # ---------------------------------------------------
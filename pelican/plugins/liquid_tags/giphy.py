@@ -27,12 +27,14 @@ try:
 except ImportError:
     from urllib import urlopen
 
-from .mdx_liquid_tags import LiquidTags
+from .mdx_liquid_tags import LiquidTags, to_thread
+from .prefetch import prefetcher, remote
 
 SYNTAX = """{% giphy gif_id ["alt text"|'alt text'] %}"""
 GIPHY = re.compile(r"""(?P<gif_id>[\S+]+)(?:\s+(['"]{0,1})(?P<alt>.+)(\\2))?""")
 
 
+@remote
 def get_gif(api_key, gif_id):
     """Returns dict with gif informations from the API."""
     url = f"http://api.giphy.com/v1/gifs/{gif_id}?api_key={api_key}"
@@ -76,14 +78,22 @@ def main(api_key, markup):
     return create_html(api_key, attrs)
 
 
+@prefetcher("giphy")
+def prefetch_giphy(configs, markup):
+    api_key = configs.getConfig("GIPHY_API_KEY")
+    match = GIPHY.search(markup)
+    if api_key is not None and match:
+        yield get_gif, (api_key, match.group("gif_id").strip())
+
+
 @LiquidTags.register("giphy")
-def giphy(preprocessor, tag, markup):
+async def giphy(preprocessor, tag, markup):
     api_key = preprocessor.configs.getConfig("GIPHY_API_KEY")
 
     if api_key is None:
         raise ValueError("Please set GIPHY_API_KEY.")
 
-    return main(api_key, markup)
+    return await to_thread(main, api_key, markup)
 
 
 # ---------------------------------------------------
@@ -43,7 +43,8 @@ try:
     from urllib.request import urlopen
 except ImportError:
     from urllib import urlopen
-from .mdx_liquid_tags import LiquidTags
+from .mdx_liquid_tags import LiquidTags, to_thread
+from .prefetch import prefetcher, remote
 
 SYNTAX = '{% gram shortcode [size] [width] [class name(s)] [title text | "title text" ["alt text"]] %}'
 
@@ -59,8 +60,30 @@ ReTitleAlt = re.compile(
 )
 
 
+def media_url(shortcode, size=None):
+    """Instagram URL redirecting to the image of a post."""
+    url = "http://instagr.am/p/" + shortcode + "/media/"
+    if size:
+        url += "?size={}".format(size)
+    return url
+
+
+@remote
+def get_media(url):
+    """Returns the status code and final location of a media URL."""
+    r = urlopen(url)
+    return r.getcode(), r.geturl()
+
+
+@prefetcher("gram")
+def prefetch_gram(configs, markup):
+    match = ReGram.search(markup)
+    if match:
+        yield get_media, (media_url(match.group("shortcode"), match.group("size")),)
+
+
 @LiquidTags.register("gram")
-def gram(preprocessor, tag, markup):
+async def gram(preprocessor, tag, markup):
     attrs = None
 
     # Parse the markup string
@@ -74,22 +97,14 @@ def gram(preprocessor, tag, markup):
 
     # Construct URI
     # print(attrs)
-    shortcode = attrs["shortcode"]
-    url = "http://instagr.am/p/" + shortcode + "/media/"
-    del attrs["shortcode"]
+    shortcode = attrs.pop("shortcode")
+    url = media_url(shortcode, attrs.pop("size", None))
 
-    if "size" in attrs:
-        size = "?size={}".format(attrs["size"])
-        url = url + size
-        del attrs["size"]
+    code, gram_url = await to_thread(get_media, url)
 
-    r = urlopen(url)
-
-    if r.getcode() == 404:
+    if code == 404:
         raise ValueError("%s isnt a photo." % shortcode)
 
-    gram_url = r.geturl()
-
     # Check if alt text is present -- if so, split it from title
     if "title" in attrs:
         match = ReTitleAlt.search(attrs["title"])
@@ -37,11 +37,15 @@ in the STATIC_PATHS setting, e.g.:
 
 [1] https://github.com/imathis/octopress/blob/master/plugins/include_code.rb
 """
+from array import array
+import codecs
+from collections import OrderedDict
 import os
 import re
 import sys
+import threading
 
-from .mdx_liquid_tags import LiquidTags
+from .mdx_liquid_tags import LiquidTags, add_dependency
 
 SYNTAX = (
     "{% include_code /path/to/code.py [lang:python] [lines:X-Y] "
@@ -70,6 +74,112 @@ FORMAT = re.compile(
 )
 
 
+# ----------------------------------------------------------------------
+# Line ranges:
+#  a ``lines:X-Y`` include reads the bytes of its lines only.  The offsets
+#  of the lines of a file are indexed as far as includes need them, and
+#  kept for the following includes; indexes are checked against the
+#  modification time and size of the file.
+_NEWLINE = re.compile(rb"\r\n?|\n")
+_CHUNK_SIZE = 1 << 20
+_MAX_INDEXES = 32
+
+
+class LineIndex:
+    """Offsets of the starts of the lines of a file, scanned on demand"""
+
+    def __init__(self, signature):
+        self.signature = signature
+        self.lock = threading.Lock()
+        self.starts = array("Q", [0])
+        self.scanned = 0
+        self.complete = False
+
+    def span(self, fh, first, last):
+        """Return the byte span of lines ``first`` to ``last`` (from 1)
+
+        Like the slice of a list of lines, the span is clipped to the file.
+        """
+        while len(self.starts) <= last and not self.complete:
+            self._scan(fh)
+        lines = len(self.starts) - 1
+        first = min(max(first, 1), lines + 1)
+        last = min(max(last, first - 1), lines)
+        return self.starts[first - 1], self.starts[last]
+
+    def _scan(self, fh):
+        fh.seek(self.scanned)
+        chunk = fh.read(_CHUNK_SIZE)
+        while chunk.endswith(b"\r"):
+            # do not split a \r\n line ending
+            extra = fh.read(1)
+            if not extra:
+                break
+            chunk += extra
+        for match in _NEWLINE.finditer(chunk):
+            self.starts.append(self.scanned + match.end())
+        self.scanned += len(chunk)
+        if len(chunk) < _CHUNK_SIZE:
+            self.complete = True
+            if self.starts[-1] != self.scanned:
+                # the last line has no line ending
+                self.starts.append(self.scanned)
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def line_index(path, stat):
+    """Return the line index of ``path`` for the file of ``stat``"""
+    path = os.path.abspath(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None or index.signature != signature:
+            index = _indexes[path] = LineIndex(signature)
+        _indexes.move_to_end(path)
+        while len(_indexes) > _MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def windowed_codec(codec):
+    """Whether lines of text in ``codec`` can be split on their bytes
+
+    The codec must encode line endings as ASCII does and have no state
+    that a read from the middle of a file would miss.
+    """
+    try:
+        name = codecs.lookup(codec).name
+    except LookupError:
+        return False
+    if name in ("utf-7", "hz") or name.startswith("iso2022"):
+        return False
+    sample = "\r\n\tcode"
+    try:
+        return sample.encode(codec) == sample.encode("ascii")
+    except UnicodeError:
+        return False
+
+
+def read_lines(path, first, last, codec="utf-8"):
+    """Return lines ``first`` to ``last`` of a file, as ``readlines`` would"""
+    if not windowed_codec(codec):
+        with open(path, encoding=codec) as fh:
+            return fh.readlines()[first - 1 : last]
+
+    with open(path, "rb") as fh:
+        index = line_index(path, os.fstat(fh.fileno()))
+        with index.lock:
+            start, end = index.span(fh, first, last)
+        fh.seek(start)
+        text = fh.read(end - start).decode(codec)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    return [line + "\n" for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+
+
 @LiquidTags.register("include_code")  # NOQA: C901
 def include_code(preprocessor, tag, markup):  # NOQA: C901
     title = None
@@ -104,12 +214,14 @@ def include_code(preprocessor, tag, markup):  # NOQA: C901
     if not codec:
         codec = "utf-8"
 
-    with open(code_path, encoding=codec) as fh:
-        if lines:
-            code = fh.readlines()[first_line - 1 : last_line]
-            code[-1] = code[-1].rstrip()
-            code = "".join(code)
-        else:
+    add_dependency(code_path)
+
+    if lines:
+        code = read_lines(code_path, first_line, last_line, codec)
+        code[-1] = code[-1].rstrip()
+        code = "".join(code)
+    else:
+        with open(code_path, encoding=codec) as fh:
             code = fh.read()
 
     if (not title and hide_filename) and not hide_all:
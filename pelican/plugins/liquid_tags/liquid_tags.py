@@ -2,8 +2,10 @@ import importlib
 import logging
 
 from pelican import signals
+from pelican.readers import MarkdownReader
 
-from .mdx_liquid_tags import LT_CONFIG, LT_HELP, LiquidTags
+from . import prefetch
+from .mdx_liquid_tags import LT_CONFIG, LT_HELP, LiquidTags, current_source
 
 logger = logging.getLogger(__name__)
 
@@ -30,13 +32,90 @@ def addLiquidTags(gen):
             LiquidTags(configs)
         )
 
+    _extension(gen.settings).content_path = gen.settings["PATH"]
+
     tags_to_import = gen.settings.get("LIQUID_TAGS", [])
+    if "notebook" in tags_to_import:
+        # content restored from Pelican's cache is not read again, so the
+        # notebook module may never be imported by a tag in this build
+        signals.all_generators_finalized.connect(finalizeNotebooks)
+        signals.finalized.connect(saveNotebookHighlights)
     for tag in tags_to_import:
+        # built-in tags are imported when they are first used in content
+        if LiquidTags.register_lazy(tag):
+            continue
         try:
             importlib.import_module(f".{tag}", "pelican.plugins.liquid_tags")
         except ModuleNotFoundError:
             logger.warn(f"Could not load liquid_tag '{tag}'")
 
+    if gen.settings.get("LIQUID_TAGS_PREFETCH"):
+        prefetch.start(
+            _extension(gen.settings),
+            gen.settings["PATH"],
+            sources=prefetch.content_sources(gen.settings),
+        )
+
+
+def _extension(settings):
+    """Return the LiquidTags extension configured in the MARKDOWN setting"""
+    for extension in reversed(settings["MARKDOWN"].get("extensions", [])):
+        if isinstance(extension, LiquidTags):
+            return extension
+
+
+class _SourceTrackingReader:
+    """Mixin making the path of the document being read known to the tags"""
+
+    def read(self, source_path):
+        token = current_source.set(source_path)
+        try:
+            return super().read(source_path)
+        finally:
+            current_source.reset(token)
+
+
+def trackSources(readers):
+    for fmt, reader_class in readers.reader_classes.items():
+        if (
+            reader_class
+            and issubclass(reader_class, MarkdownReader)
+            and not issubclass(reader_class, _SourceTrackingReader)
+        ):
+            readers.reader_classes[fmt] = type(
+                reader_class.__name__, (_SourceTrackingReader, reader_class), {}
+            )
+
+
+def finalizeNotebooks(generators):
+    from . import notebook
+
+    notebook.resolve_conversions(generators)
+    notebook.restore_files(generators)
+    notebook.write_header(generators)
+
+
+def saveNotebookHighlights(pelican):
+    from . import notebook
+
+    notebook.save_highlights(pelican)
+
+
+def reportStats(pelican):
+    extension = _extension(pelican.settings)
+    tag_stats = extension.tag_stats() if extension else None
+    if tag_stats is None:
+        return
+    if extension.getConfig("LIQUID_TAGS_STATS"):
+        print("\n ** Liquid tags **\n")
+        print(tag_stats.format_table())
+    stats_file = extension.getConfig("LIQUID_TAGS_STATS_FILE")
+    if stats_file:
+        tag_stats.write_json(stats_file)
+
 
 def register():
     signals.initialized.connect(addLiquidTags)
+    signals.readers_init.connect(trackSources)
+    signals.finalized.connect(prefetch.clear)
+    signals.finalized.connect(reportStats)
@@ -9,76 +9,575 @@ Where "tag" is associated with some user-defined extension.
 These result in a preprocess step within markdown that produces
 either markdown or html.
 """
-import itertools
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
+import importlib
+import inspect
+import logging
+import os
 import re
+import threading
+import time
 import warnings
 
 import markdown
 
+from . import cache, profiling, stats
+
 # Define some regular expressions
 LIQUID_TAG = re.compile(r"\{%.*?%\}", re.MULTILINE | re.DOTALL)
 EXTRACT_TAG = re.compile(r"(?:\s*)(\S+)(?:\s*)")
+logger = logging.getLogger(__name__)
+
 LT_CONFIG = {
     "CODE_DIR": "code",
     "NOTEBOOK_DIR": "notebooks",
+    "NOTEBOOK_STORE_MAX_SIZE": 256 * 1024 * 1024,
+    "NOTEBOOK_PROCESSES": 0,
+    "NOTEBOOK_IMAGES": False,
+    "NOTEBOOK_IMAGES_DIR": "images/notebooks",
+    "NOTEBOOK_CELL_OUTPUT_MAX_SIZE": 0,
+    "NOTEBOOK_OUTPUT_MAX_SIZE": 0,
+    "NOTEBOOK_OUTPUTS_DIR": "outputs/notebooks",
+    "NOTEBOOK_STYLES_DIR": "styles/notebooks",
+    "NOTEBOOK_HEADER_FILE": "_nb_header.html",
+    "SITEURL": "",
+    "OUTPUT_PATH": "output",
     "FLICKR_API_KEY": "flickr",
     "GIPHY_API_KEY": "giphy",
     "IMG_DEFAULT_LOADING": "eager",
     "YOUTUBE_THUMB_ONLY": False,
     "YOUTUBE_THUMB_SIZE": "",
     "YOUTUBE_INVIDIOUS_INSTANCE": "",
+    "CACHE_PATH": "cache",
+    "LIQUID_TAGS_CACHE": False,
+    "LIQUID_TAGS_CACHE_MAX_SIZE": 256 * 1024 * 1024,
+    "LIQUID_TAGS_CACHE_MAX_ENTRIES": 10000,
+    "LIQUID_TAGS_THREADS": 0,
+    "LIQUID_TAGS_PREFETCH": False,
+    "LIQUID_TAGS_PREFETCH_WORKERS": 16,
+    "LIQUID_TAGS_STATS": False,
+    "LIQUID_TAGS_STATS_FILE": "",
+    "LIQUID_TAGS_SLOW_THRESHOLD": 0,
+    "LIQUID_TAGS_PROFILE": [],
+    "LIQUID_TAGS_PROFILE_PATHS": [],
 }
 LT_HELP = {
     "CODE_DIR": "Code directory for include_code subplugin",
     "NOTEBOOK_DIR": "Notebook directory for notebook subplugin",
+    "NOTEBOOK_STORE_MAX_SIZE": "Size of the parsed notebooks kept in memory",
+    "NOTEBOOK_PROCESSES": "Processes converting notebooks (0: in the reader)",
+    "NOTEBOOK_IMAGES": "Write notebook output images to files instead of inlining",
+    "NOTEBOOK_IMAGES_DIR": "Directory of notebook images in the output directory",
+    "NOTEBOOK_CELL_OUTPUT_MAX_SIZE": "Size of the outputs shown per cell (0: all)",
+    "NOTEBOOK_OUTPUT_MAX_SIZE": "Size of the outputs shown per notebook (0: all)",
+    "NOTEBOOK_OUTPUTS_DIR": "Directory of cut notebook outputs in the output directory",
+    "NOTEBOOK_STYLES_DIR": "Directory of the notebook stylesheet in the output directory",
+    "NOTEBOOK_HEADER_FILE": "File the notebook header is written to",
+    "SITEURL": "Pelican site URL, used in links to generated files",
+    "OUTPUT_PATH": "Pelican output directory, used for generated files",
     "FLICKR_API_KEY": "Flickr key for accessing the API",
     "GIPHY_API_KEY": "Giphy key for accessing the API",
     "IMG_DEFAULT_LOADING": "The default loading method of images (eager or lazy)",
     "YOUTUBE_THUMB_ONLY": "Embed a linked thumbnail instead 1MB of JS code",
     "YOUTUBE_THUMB_SIZE": "Thumbnail dimensions maxres/sd (default)/hq/mq",
     "YOUTUBE_INVIDIOUS_INSTANCE": "Alternative YouTube frontend",
+    "CACHE_PATH": "Pelican cache directory, also used for rendered tags",
+    "LIQUID_TAGS_CACHE": "Cache rendered tag output across runs",
+    "LIQUID_TAGS_CACHE_MAX_SIZE": "Size limit of the tag cache in bytes",
+    "LIQUID_TAGS_CACHE_MAX_ENTRIES": "Maximum number of cached tags",
+    "LIQUID_TAGS_THREADS": "Threads rendering the tags of a document (0: serial)",
+    "LIQUID_TAGS_PREFETCH": "Fetch remote resources of all content at startup",
+    "LIQUID_TAGS_PREFETCH_WORKERS": "Maximum number of concurrent prefetches",
+    "LIQUID_TAGS_STATS": "Print per-tag timings at the end of the build",
+    "LIQUID_TAGS_STATS_FILE": "Write per-tag timings to this JSON file",
+    "LIQUID_TAGS_SLOW_THRESHOLD": "Log tags taking longer (in seconds); 0: off",
+    "LIQUID_TAGS_PROFILE": "Tags to run under cProfile (True: all tags)",
+    "LIQUID_TAGS_PROFILE_PATHS": "Only profile tags in sources matching these globs",
 }
 
+# settings which do not affect the output of a tag
+_RUNTIME_CONFIG = {
+    "NOTEBOOK_STORE_MAX_SIZE",
+    "NOTEBOOK_PROCESSES",
+    "NOTEBOOK_STYLES_DIR",
+    "NOTEBOOK_HEADER_FILE",
+    "OUTPUT_PATH",
+    "CACHE_PATH",
+    "LIQUID_TAGS_CACHE",
+    "LIQUID_TAGS_CACHE_MAX_SIZE",
+    "LIQUID_TAGS_CACHE_MAX_ENTRIES",
+    "LIQUID_TAGS_THREADS",
+    "LIQUID_TAGS_PREFETCH",
+    "LIQUID_TAGS_PREFETCH_WORKERS",
+    "LIQUID_TAGS_STATS",
+    "LIQUID_TAGS_STATS_FILE",
+    "LIQUID_TAGS_SLOW_THRESHOLD",
+    "LIQUID_TAGS_PROFILE",
+    "LIQUID_TAGS_PROFILE_PATHS",
+}
+
+# modules of this package implementing the built-in tags
+TAG_MODULES = {
+    "audio": "audio",
+    "b64img": "b64img",
+    "blockdiag": "diag",
+    "flickr": "flickr",
+    "generic": "generic",
+    "giphy": "giphy",
+    "gram": "gram",
+    "graphviz": "graphviz",
+    "img": "img",
+    "include_code": "include_code",
+    "literal": "literal",
+    "notebook": "notebook",
+    "pygal": "pygalcharts",
+    "soundcloud": "soundcloud",
+    "speakerdeck": "speakerdeck",
+    "spotify": "spotify",
+    "video": "video",
+    "vimeo": "vimeo",
+    "youtube": "youtube",
+}
+
+# tags enabled in LIQUID_TAGS whose module is imported on first use
+_lazy_tags = {}
+
+# tags found in content without a handler, reported once each
+_unknown_tags = set()
+_unknown_tags_lock = threading.Lock()
+
+_STASH_MARKER = "\x02liquid-tags-stash:{}\x03"
+
+# path of the document being converted, set by the Pelican reader
+current_source = contextvars.ContextVar("liquid_tags_current_source", default=None)
+
+_current_call = contextvars.ContextVar("liquid_tags_current_call", default=None)
+
+
+def add_dependency(path):
+    """Declare that the tag being rendered reads the file at ``path``
+
+    Cached output of the tag is only reused while the file is unchanged.
+    Outside of a render (e.g. when a handler is called directly) this does
+    nothing.
+    """
+    call = _current_call.get()
+    if call is not None:
+        call.dependencies.append(os.path.abspath(path))
+
+
+def load_tag(tag):
+    """Return the handler of ``tag``, importing its module on first use
+
+    Returns None for tags that are neither registered nor enabled.
+    """
+    handler = _LiquidTagsPreprocessor._tags.get(tag)
+    if handler is None and tag in _lazy_tags:
+        module = _lazy_tags.pop(tag)
+        try:
+            importlib.import_module(f".{module}", __package__)
+        except ImportError as e:
+            logger.warning("Could not load liquid_tag '%s': %s", module, e)
+        handler = _LiquidTagsPreprocessor._tags.get(tag)
+    return handler
+
+
+class _RecordingStash:
+    """Stands in for ``md.htmlStash`` while a single tag is rendered
+
+    Stored blocks are set aside and replaced by positional markers, so the
+    output of a tag can be cached and replayed into the real stash later.
+    """
+
+    def __init__(self):
+        self.blocks = []
+
+    def store(self, html):
+        self.blocks.append(html)
+        return _STASH_MARKER.format(len(self.blocks) - 1)
+
+
+class _ConfigsView:
+    """The extension as seen through ``preprocessor.configs`` by a handler"""
+
+    def __init__(self, configs, stash):
+        self._configs = configs
+        self.htmlStash = stash
+
+    def __getattr__(self, name):
+        return getattr(self._configs, name)
+
+
+class _TagCall:
+    """The ``preprocessor`` argument passed to a tag handler"""
+
+    def __init__(self, preprocessor):
+        self._preprocessor = preprocessor
+        self.stash = _RecordingStash()
+        self.configs = _ConfigsView(preprocessor.configs, self.stash)
+        self.dependencies = []
+
+    def __getattr__(self, name):
+        return getattr(self._preprocessor, name)
+
+    def result(self, output):
+        """Return the output of the handler with its stash blocks and files"""
+        files = [(path, cache.file_digest(path)) for path in self.dependencies]
+        return output, self.stash.blocks, files
+
+
+async def _gather(coroutines):
+    """Await ``(future, coroutine)`` pairs concurrently, filling the futures"""
+    results = await asyncio.gather(
+        *(coroutine for _, coroutine in coroutines), return_exceptions=True
+    )
+    for (future, _), result in zip(coroutines, results):
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+async def to_thread(func, *args):
+    """Run a blocking function from an ``async def`` handler
+
+    The function runs on the default executor of the event loop, in the
+    context of the calling handler (so ``add_dependency`` keeps working).
+    Equivalent to ``asyncio.to_thread`` on Python 3.9 and later.
+    """
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, context.run, func, *args)
+
 
 class _LiquidTagsPreprocessor(markdown.preprocessors.Preprocessor):
     _tags = {}
 
     def __init__(self, configs):
         self.configs = configs
+        self.source_path = None
 
     def run(self, lines):
-        page = "\n".join(lines)
-        liquid_tags = LIQUID_TAG.findall(page)
+        # most documents contain no tags at all: hand them back untouched
+        if not any("{%" in line for line in lines):
+            return lines
+        self.source_path = current_source.get()
+
+        output = []
+        current = []
+        for text in self._rendered_segments("\n".join(lines)):
+            # stitch the segment onto the line list as we go, so the page
+            # is never rebuilt and resplit as a whole
+            head, *rest = text.split("\n")
+            current.append(head)
+            if rest:
+                output.append("".join(current))
+                output.extend(rest[:-1])
+                current = [rest[-1]]
+        output.append("".join(current))
+        return output
+
+    def _rendered_segments(self, page):
+        """Yield the text of ``page`` with every tag replaced, in order
+
+        Tags with ``async def`` handlers are awaited together on the event
+        loop of the extension.  When a thread pool is configured, the other
+        tags are submitted to it before the first one is committed.  Results
+        are always committed to the stash in document order, so the output
+        matches a serial run.
+        """
+        pool = self.configs.thread_pool()
+        pending = []
+        coroutines = []
+        index = 0
+        for is_tag, text in _iter_segments(page):
+            tag, markup = _parse_tag(text) if is_tag else (None, None)
+            handler = load_tag(tag) if tag is not None else None
+            if handler is None:
+                if tag is not None:
+                    self._unknown(tag)
+                pending.append(text)
+                continue
+            index += 1
+            if inspect.iscoroutinefunction(handler):
+                future = Future()
+                coroutines.append((future, self._render_async(handler, tag, markup)))
+                pending.append(future)
+            elif pool is not None:
+                pending.append(pool.submit(self._render, handler, tag, markup, index))
+            else:
+                pending.append(self._render(handler, tag, markup, index))
+
+        if coroutines:
+            self.configs.event_loop().run_until_complete(_gather(coroutines))
+
+        for item in pending:
+            if isinstance(item, Future):
+                item = item.result()
+            yield item if isinstance(item, str) else self._commit(item)
+
+    def _render(self, handler, tag, markup, index=0):
+        """Render a single tag without touching the stash"""
+        started = time.perf_counter()
+        key, rendered = self._cached(handler, tag, markup)
+        hit = rendered is not None
+        if not hit:
+            call = _TagCall(self)
+            token = _current_call.set(call)
+            profiler = self.configs.tag_profiler()
+            try:
+                if profiler is not None and profiler.wants(tag, self.source_path):
+                    output = profiler.call(
+                        profiler.filename(tag, self.source_path, index),
+                        handler,
+                        call,
+                        tag,
+                        markup,
+                    )
+                else:
+                    output = handler(call, tag, markup)
+                rendered = call.result(output)
+            finally:
+                _current_call.reset(token)
+            self._store(key, rendered)
+        self._record(tag, markup, started, rendered, key, hit)
+        return rendered
+
+    async def _render_async(self, handler, tag, markup):
+        """Render a single tag with an ``async def`` handler"""
+        started = time.perf_counter()
+        key, rendered = self._cached(handler, tag, markup)
+        hit = rendered is not None
+        if not hit:
+            # every coroutine runs in a task of its own, with its own context
+            call = _TagCall(self)
+            _current_call.set(call)
+            rendered = call.result(await handler(call, tag, markup))
+            self._store(key, rendered)
+        self._record(tag, markup, started, rendered, key, hit)
+        return rendered
+
+    def _unknown(self, tag):
+        """Count a tag without a handler, which is left as it is"""
+        tag_stats = self.configs.tag_stats()
+        if tag_stats is not None:
+            tag_stats.record_unknown(tag, self.source_path)
+        with _unknown_tags_lock:
+            if tag in _unknown_tags:
+                return
+            _unknown_tags.add(tag)
+        logger.info(
+            "Unknown liquid tag '%s' in %s is left unchanged; "
+            "built-in tags must be enabled in LIQUID_TAGS",
+            tag,
+            self.source_path or "<unknown>",
+        )
+
+    def _record(self, tag, markup, started, rendered, key, hit):
+        tag_stats = self.configs.tag_stats()
+        if tag_stats is not None:
+            output, blocks, _ = rendered
+            tag_stats.record(
+                tag,
+                self.source_path,
+                markup,
+                time.perf_counter() - started,
+                sum(len(str(part).encode("utf-8")) for part in [output] + blocks),
+                hit if key is not None else None,
+            )
+
+    def _cached(self, handler, tag, markup):
+        return self.configs.cached_render(handler, tag, markup)
+
+    def _store(self, key, rendered):
+        if key is not None:
+            self.configs.tag_cache().set(key, rendered)
+
+    def _commit(self, rendered):
+        """Store recorded blocks in the real stash, in document order"""
+        output, blocks, _ = rendered
+        for i, block in enumerate(blocks):
+            placeholder = self.configs.htmlStash.store(block)
+            output = output.replace(_STASH_MARKER.format(i), placeholder)
+        return output
+
+
+def iter_tags(page):
+    """Yield the ``(tag, markup)`` of every liquid tag in ``page``"""
+    for is_tag, text in _iter_segments(page):
+        if is_tag:
+            tag, markup = _parse_tag(text)
+            if tag is not None:
+                yield tag, markup
+
 
-        for i, markup in enumerate(liquid_tags):
-            # remove {% %}
-            markup = markup[2:-2]
-            tag = EXTRACT_TAG.match(markup).groups()[0]
-            markup = EXTRACT_TAG.sub("", markup, 1)
-            if tag in self._tags:
-                liquid_tags[i] = self._tags[tag](self, tag, markup.strip())
+def _parse_tag(text):
+    """Split ``{% tag markup %}`` into its name and markup"""
+    # remove {% %}
+    markup = text[2:-2]
+    match = EXTRACT_TAG.match(markup)
+    if match is None:
+        return None, markup
+    return match.group(1), markup[match.end() :].strip()
 
-        # add an empty string to liquid_tags so that chaining works
-        liquid_tags.append("")
 
-        # reconstruct string
-        page = "".join(itertools.chain(*zip(LIQUID_TAG.split(page), liquid_tags)))
+def _iter_segments(page):
+    """Yield ``(is_tag, text)`` pairs covering ``page`` in order
 
-        # resplit the lines
-        return page.split("\n")
+    Delimiters are located with plain substring searches that only ever move
+    forward, so the scan is linear in the size of the page.  A ``{%`` without
+    a closing ``%}`` ends the scan: no later tag could be closed either, so
+    the remainder is passed through as literal text and reported once.
+    """
+    pos = 0
+    while True:
+        start = page.find("{%", pos)
+        if start < 0:
+            break
+        end = page.find("%}", start + 2)
+        if end < 0:
+            line, column = _line_and_column(page, start)
+            logger.warning(
+                "Unterminated liquid tag in %s at line %d, column %d: %r",
+                current_source.get() or "<unknown>",
+                line,
+                column,
+                page[start : start + 40],
+            )
+            break
+        if start > pos:
+            yield False, page[pos:start]
+        pos = end + 2
+        yield True, page[start:pos]
+    if pos < len(page):
+        yield False, page[pos:]
+
+
+def _line_and_column(page, index):
+    """Return the 1-based line and column of ``index`` within ``page``"""
+    line_start = page.rfind("\n", 0, index) + 1
+    return page.count("\n", 0, index) + 1, index - line_start + 1
 
 
 class LiquidTags(markdown.Extension):
     """Wrapper for MDPreprocessor"""
 
     def __init__(self, config):
+        # markdown.Extension.config is a class attribute: give each instance
+        # its own so that settings do not leak between extensions
+        self.config = {}
         for key, value in LT_CONFIG.items():
             self.config[key] = [value, LT_HELP[key]]
         super().__init__(**config)
+        # Pelican's content directory, which profiles are named relative to;
+        # set by the plugin
+        self.content_path = "content"
+        self._init_runtime()
+
+    def _init_runtime(self):
+        self._cache = None
+        self._pool = None
+        self._loop = None
+        self._stats = None
+        self._profiler = None
+        # the getters below are first called from the render and prefetch
+        # threads: each object must be created once
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Pelican pickles the settings, and with them the extension, into its
+        # content cache: leave out the objects created at runtime
+        state = dict(self.__dict__)
+        for name in ("_cache", "_pool", "_loop", "_stats", "_profiler", "_lock"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_runtime()
+
+    def tag_cache(self):
+        """Return the render cache, or None if it is disabled"""
+        with self._lock:
+            if self._cache is None and self.getConfig("LIQUID_TAGS_CACHE"):
+                self._cache = cache.TagCache(
+                    os.path.join(self.getConfig("CACHE_PATH"), cache.CACHE_DIR),
+                    self.getConfig("LIQUID_TAGS_CACHE_MAX_SIZE"),
+                    self.getConfig("LIQUID_TAGS_CACHE_MAX_ENTRIES"),
+                )
+            return self._cache
+
+    def cached_render(self, handler, tag, markup):
+        """Return the cache key of a tag and its cached rendering, if valid"""
+        tag_cache = self.tag_cache()
+        if tag_cache is None:
+            return None, None
+
+        key = cache.make_key(
+            tag,
+            markup.replace("\r\n", "\n"),
+            sorted(
+                (k, v) for k, v in self.getConfigs().items() if k not in _RUNTIME_CONFIG
+            ),
+            cache.handler_fingerprint(handler),
+        )
+        rendered = tag_cache.get(key)
+        if rendered is None or any(
+            cache.file_digest(path) != digest for path, digest in rendered[2]
+        ):
+            return key, None
+        return key, rendered
+
+    def thread_pool(self):
+        """Return the pool rendering tags concurrently, or None if serial"""
+        threads = self.getConfig("LIQUID_TAGS_THREADS")
+        if self._pool is None and threads:
+            self._pool = ThreadPoolExecutor(
+                max_workers=threads, thread_name_prefix="liquid-tags"
+            )
+        return self._pool
+
+    def tag_stats(self):
+        """Return the collector of tag timings, or None if disabled"""
+        with self._lock:
+            if self._stats is None and (
+                self.getConfig("LIQUID_TAGS_STATS")
+                or self.getConfig("LIQUID_TAGS_STATS_FILE")
+                or self.getConfig("LIQUID_TAGS_SLOW_THRESHOLD")
+            ):
+                self._stats = stats.TagStats(
+                    self.getConfig("LIQUID_TAGS_SLOW_THRESHOLD")
+                )
+            return self._stats
+
+    def tag_profiler(self):
+        """Return the profiler of tag handlers, or None if disabled"""
+        tags = self.getConfig("LIQUID_TAGS_PROFILE")
+        with self._lock:
+            if self._profiler is None and tags:
+                self._profiler = profiling.TagProfiler(
+                    os.path.join(self.getConfig("CACHE_PATH"), profiling.PROFILE_DIR),
+                    tags,
+                    self.getConfig("LIQUID_TAGS_PROFILE_PATHS"),
+                    self.content_path,
+                )
+            return self._profiler
+
+    def event_loop(self):
+        """Return the event loop running ``async def`` handlers"""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop
 
     @classmethod
     def register(cls, tag):
-        """Decorator to register a new include tag"""
+        """Decorator to register a new include tag
+
+        The handler may be an ``async def`` function: the coroutines of all
+        such tags in a document are awaited concurrently.
+        """
 
         def dec(func):
             if tag in _LiquidTagsPreprocessor._tags:
@@ -88,6 +587,18 @@ class LiquidTags(markdown.Extension):
 
         return dec
 
+    @classmethod
+    def register_lazy(cls, module):
+        """Enable the built-in tags of ``module`` without importing it yet
+
+        Returns False if the tags of the module are not known in advance.
+        """
+        tags = [tag for tag, name in TAG_MODULES.items() if name == module]
+        for tag in tags:
+            if tag not in _LiquidTagsPreprocessor._tags:
+                _lazy_tags[tag] = module
+        return bool(tags)
+
     def extendMarkdown(self, md):
         self.htmlStash = md.htmlStash
         md.registerExtension(self)
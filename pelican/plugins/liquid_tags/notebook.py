@@ -1,7 +1,7 @@
 """
 Notebook Tag
 ------------
-This is a liquid-style tag to include a static html rendering of an IPython
+This is a liquid-style tag to include a static html rendering of a Jupyter
 notebook in a blog post.
 
 Syntax
@@ -22,15 +22,16 @@ or ipython3 syntax highlighting should be used.
 
 Requirements
 ------------
-- The plugin requires IPython version 1.0 or above.  It no longer supports the
-  standalone nbconvert package, which has been deprecated.
+- The plugin requires the ``nbformat`` and ``nbconvert`` packages, which are
+  imported when the first notebook is converted.  IPython is not needed.
 
 Details
 -------
 Because the notebook relies on some rather extensive custom CSS, the use of
 this plugin requires additional CSS to be inserted into the blog theme.
 After typing "make html" when using the notebook tag, a file called
-``_nb_header.html`` will be produced in the main directory.  The content
+``_nb_header.html`` will be produced in the main directory (or at the path
+given by the ``NOTEBOOK_HEADER_FILE`` setting).  The content
 of the file should be included in the header of the theme.  An easy way
 to accomplish this is to add the following lines within the header template
 of the theme you use:
@@ -43,72 +44,42 @@ and in your ``pelicanconf.py`` file, include the line:
 
     EXTRA_HEADER = open('_nb_header.html').read().decode('utf-8')
 
-this will insert the appropriate CSS.  All efforts have been made to ensure
+this will insert the appropriate CSS.  The header links to a minified
+stylesheet, written on every build to ``NOTEBOOK_STYLES_DIR`` in the output
+directory under a name derived from its content.  All efforts have been made to ensure
 that this CSS will not override formats within the blog theme, but there may
 still be some conflicts.
 """
-from copy import deepcopy
+import base64
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from functools import partial
+import hashlib
+from html import escape
+import json
+import logging
+import mmap
+import multiprocessing
 import os
+import pickle
 import re
-import warnings
+import shutil
+import struct
+import tempfile
+import threading
+import uuid
 
-import IPython
+from pygments import __version__ as pygments_version
 from pygments.formatters import HtmlFormatter
 
-from .mdx_liquid_tags import LiquidTags
+from pelican import signals
 
-IPYTHON_VERSION = IPython.version_info[0]
+from . import cache
+from .mdx_liquid_tags import LT_CONFIG, LiquidTags, add_dependency
+from .prefetch import prefetcher, remote
 
-try:
-    import nbformat
-except ImportError:
-    pass
-
-if not IPYTHON_VERSION >= 1:
-    raise ValueError("IPython version 1.0+ required for notebook tag")
-
-if IPYTHON_VERSION > 1:
-    warnings.warn(
-        "Pelican plugin is not designed to work with IPython "
-        "versions greater than 1.x. CSS styles have changed in "
-        "later releases."
-    )
-
-try:
-    from nbconvert.filters.highlight import _pygments_highlight
-except ImportError:
-    try:
-        from IPython.nbconvert.filters.highlight import _pygments_highlight
-    except ImportError:
-        # IPython < 2.0
-        from IPython.nbconvert.filters.highlight import (
-            _pygment_highlight as _pygments_highlight,
-        )
-
-try:
-    from nbconvert.exporters import HTMLExporter
-except ImportError:
-    from IPython.nbconvert.exporters import HTMLExporter
-
-try:
-    from traitlets.config import Config
-except ImportError:
-    from IPython.config import Config
-
-try:
-    from nbconvert.preprocessors import Preprocessor
-except ImportError:
-    try:
-        from IPython.nbconvert.preprocessors import Preprocessor
-    except ImportError:
-        # IPython < 2.0
-        from IPython.nbconvert.transformers import Transformer as Preprocessor
-
-try:
-    from traitlets import Integer
-except ImportError:
-    from IPython.utils.traitlets import Integer
+logger = logging.getLogger(__name__)
 
 # ----------------------------------------------------------------------
 # Some code that will be added to the header:
@@ -116,8 +87,7 @@ except ImportError:
 #  IPython/nbconvert/templates/fullhtml.tpl, while some are custom tags
 #  specifically designed to make the results look good within the
 #  pelican-octopress theme.
-JS_INCLUDE = r"""
-<style type="text/css">
+NOTEBOOK_CSS = r"""
 /* Overrides of notebook CSS for static HTML export */
 div.entry-content {
   overflow: visible;
@@ -167,8 +137,9 @@ div.collapseheader {
     cursor: pointer;
     font-family:"Helvetica Neue",Helvetica,Arial,sans-serif;
 }
-</style>
+"""
 
+MATHJAX_INCLUDE = r"""
 <script type="text/x-mathjax-config">
 MathJax.Hub.Config({
     tex2jax: {
@@ -180,97 +151,921 @@ MathJax.Hub.Config({
 </script>
 <script type="text/javascript" async src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.2/MathJax.js?config=TeX-MML-AM_CHTML">
 </script>
+"""
 
-<script src="https://ajax.googleapis.com/ajax/libs/jquery/1.10.2/jquery.min.js"></script>
-
+# toggles collapsible code cells; listening on the document, it needs neither
+# a library nor the page to be loaded
+COLLAPSE_SCRIPT = r"""
 <script type="text/javascript">
-jQuery(document).ready(function($) {
-    $("div.collapseheader").click(function () {
-    $header = $(this).children("span").first();
-    $codearea = $(this).children(".input_area");
-    console.log($(this).children());
-    $codearea.slideToggle(500, function () {
-        $header.text(function () {
-            return $codearea.is(":visible") ? "Collapse Code" : "Expand Code";
-        });
-    });
-});
+document.addEventListener("click", function (event) {
+    var header = event.target.closest && event.target.closest("div.collapseheader");
+    var code = header && header.querySelector(":scope > .input_area");
+    if (!code) {
+        return;
+    }
+    var hide = code.style.display !== "none";
+    code.style.display = hide ? "none" : "";
+    header.querySelector("span").textContent = hide ? "Expand Code" : "Collapse Code";
 });
 </script>
-
 """
 
-CSS_WRAPPER = """
-<style type="text/css">
-{0}
-</style>
-"""
+JS_INCLUDE = MATHJAX_INCLUDE + COLLAPSE_SCRIPT
+
+HEADER_FILE = LT_CONFIG["NOTEBOOK_HEADER_FILE"]
 
 
 # ----------------------------------------------------------------------
-# Create a custom preprocessor
-class SliceIndex(Integer):
-    """An integer trait that accepts None"""
+# Selecting cells
+def slice_cells(nb, start, end):
+    """Return a shallow copy of ``nb`` holding only ``cells[start:end]``
 
-    default_value = None
+    The cells themselves are shared with ``nb``, which is left unchanged.
+    """
+    nbc = type(nb)(nb)
+    nbc.cells = nb.cells[start:end]
+    return nbc
 
-    def validate(self, obj, value):
-        if value is None:
-            return value
-        else:
-            return super().validate(obj, value)
 
+def select_cells(count, selection, cell, contains=None):
+    """Return the indices of the cells of a notebook picked by ``selection``
+
+    ``selection`` is ``tag:a,b`` for the cells with one of the tags,
+    ``id:x,y`` for the cells with one of the ids, or a list of indices such
+    as ``1,5,9``.  ``cell(i)`` returns cell ``i`` of the ``count`` cells,
+    and ``contains(i, text)``, if given, whether cell ``i`` can contain
+    ``text``, to rule out cells without decoding them.
+    """
+    kind, values = selection.split(":", 1) if ":" in selection else ("", selection)
+    kind = kind.strip()
+    values = [value.strip() for value in values.split(",") if value.strip()]
+    if not values:
+        raise ValueError(f"Invalid cell selection: {selection}")
+    if not kind:
+        try:
+            indices = [int(value) for value in values]
+        except ValueError:
+            raise ValueError(f"Invalid cell selection: {selection}") from None
+        for i in indices:
+            if not -count <= i < count:
+                raise ValueError(f"Cell {i} is out of range")
+        return sorted({i % count for i in indices})
+
+    if kind == "tag":
+
+        def selected(c):
+            tags = (c.get("metadata") or {}).get("tags") or ()
+            return any(tag in values for tag in tags)
+
+    elif kind == "id":
+
+        def selected(c):
+            return c.get("id") in values
+
+    else:
+        raise ValueError(f"Invalid cell selection: {selection}")
 
-class SubCell(Preprocessor):
-    """A transformer to select a slice of the cells of a notebook"""
+    # strings that other JSON encoders may escape cannot be searched for
+    plain = all(json.dumps(v)[1:-1] == v and v.isascii() for v in values)
+    if contains is None or not plain or "/" in "".join(values):
+        candidates = range(count)
+    else:
+        candidates = [
+            i for i in range(count) if any(contains(i, value) for value in values)
+        ]
+    return [i for i in candidates if selected(cell(i))]
 
-    start = SliceIndex(0, config=True, help="first cell of notebook to be converted")
-    end = SliceIndex(None, config=True, help="last cell of notebook to be converted")
 
-    def preprocess(self, nb, resources):
-        nbc = deepcopy(nb)
-        if IPYTHON_VERSION < 3:
-            for worksheet in nbc.worksheets:
-                cells = worksheet.cells[:]
-                worksheet.cells = cells[self.start : self.end]
+# ----------------------------------------------------------------------
+# Parsed notebooks:
+#  a post often embeds several slices of the same notebook.  Each file is
+#  parsed once per version into a ``NotebookIndex`` shared by all tags of the
+#  process, and slices are read from the index; entries are checked against
+#  the modification time and size of the file.
+class NotebookStore:
+    """Notebook indexes, evicted least recently used first
+
+    ``max_size`` bounds the total size of the stored indexes, unless a call
+    to ``get`` gives its own bound.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def get(self, path, start=0, end=None, selection=None, max_size=None):
+        """Return a notebook holding ``cells[start:end]`` of ``path``
+
+        With ``selection``, the notebook holds the cells it picks instead
+        (see ``select_cells``).  The notebook must not be modified.
+        """
+        path = os.path.abspath(path)
+        try:
+            return self.index(path, max_size).read(start, end, selection)[0]
+        except FileChangedError:
+            # changed since it was checked: index the new version
+            return self.index(path, max_size).read(start, end, selection)[0]
+
+    def index(self, path, max_size=None):
+        """Return the index of the current version of ``path``"""
+        if max_size is None:
+            max_size = self.max_size
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            index = self._entries.get(path)
+            if index is not None and index.signature == signature:
+                self._entries.move_to_end(path)
+                return index
+
+        index = index_notebook(path)
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._size -= old.size
+            if index.size <= max_size:
+                self._entries[path] = index
+                self._size += index.size
+            while self._size > max_size:
+                self._size -= self._entries.popitem(last=False)[1].size
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+# ----------------------------------------------------------------------
+# Reading notebooks:
+#  outputs make up most of a notebook file, and a tag usually shows a few
+#  cells.  nbformat 4 files are scanned without decoding the cells outside
+#  of the requested range; other files are parsed whole.
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+_STRUCTURE = re.compile(rb'[\[\]{}"]')
+_SCALAR = re.compile(rb"[^,:\]}\s]+")
+
+
+def _skip(buf, pos, char):
+    """Return the position after ``char`` and the whitespace around it"""
+    pos = _WHITESPACE.match(buf, pos).end()
+    if buf[pos : pos + 1] != char:
+        raise ValueError(f"expected {char!r} at offset {pos}")
+    return _WHITESPACE.match(buf, pos + 1).end()
+
+
+def _string_end(buf, pos):
+    """Return the end of the JSON string starting at ``pos``"""
+    end = pos
+    while True:
+        end = buf.find(b'"', end + 1)
+        if end < 0:
+            raise ValueError(f"unterminated string at offset {pos}")
+        escapes = end - 1
+        while buf[escapes] == 0x5C:  # backslash
+            escapes -= 1
+        if (end - escapes) % 2:
+            return end + 1
+
+
+def _value_end(buf, pos):
+    """Return the end of the JSON value starting at ``pos``"""
+    first = buf[pos : pos + 1]
+    if first == b'"':
+        return _string_end(buf, pos)
+    if first not in (b"{", b"["):
+        match = _SCALAR.match(buf, pos)
+        if match is None:
+            raise ValueError(f"expected a value at offset {pos}")
+        return match.end()
+    depth = 0
+    while True:
+        match = _STRUCTURE.search(buf, pos)
+        if match is None:
+            raise ValueError("unterminated value")
+        char = match.group()
+        if char == b'"':
+            pos = _string_end(buf, match.start())
+            continue
+        pos = match.end()
+        depth += 1 if char in (b"{", b"[") else -1
+        if not depth:
+            return pos
+
+
+def _members(buf, pos, close, cells=None):
+    """Locate the members of the object or array at ``pos``
+
+    Return the ``(key, start, end)`` spans of the members (``key`` is None
+    for array items) and the end of the container.  The item spans of a
+    ``"cells"`` array member are appended to ``cells``.
+    """
+    members = []
+    pos = _skip(buf, pos, b"{" if close == b"}" else b"[")
+    while buf[pos : pos + 1] != close:
+        if members:
+            pos = _skip(buf, pos, b",")
+        key = None
+        if close == b"}":
+            end = _string_end(buf, pos)
+            key = json.loads(buf[pos:end])
+            pos = _skip(buf, end, b":")
+        if key == "cells" and cells is not None and buf[pos : pos + 1] == b"[":
+            items, end = _members(buf, pos, b"]")
+            cells.extend((first, last) for _, first, last in items)
         else:
-            nbc.cells = nbc.cells[self.start : self.end]
+            end = _value_end(buf, pos)
+        members.append((key, pos, end))
+        pos = _WHITESPACE.match(buf, end).end()
+    return members, pos + 1
+
+
+def scan_notebook(buf):
+    """Locate the cells and decode the other fields of a notebook
+
+    Return the fields as a dict, the spans of the cells and the number of
+    bytes decoded, or None if ``buf`` does not hold an nbformat 4 notebook.
+    """
+    cells = []
+    members, _ = _members(buf, _WHITESPACE.match(buf).end(), b"}", cells)
+    fields = {key: (first, last) for key, first, last in members if key != "cells"}
+    if "nbformat" not in fields or json.loads(buf[slice(*fields["nbformat"])]) != 4:
+        return None
+    nb = {key: json.loads(buf[first:last]) for key, (first, last) in fields.items()}
+    return nb, cells, sum(last - first for first, last in fields.values())
+
+
+def decode_cells(buf, cells, start=0, end=None, selection=None):
+    """Decode the cells of ``buf`` at the spans ``cells[start:end]``
+
+    With ``selection``, the cells it picks are decoded instead.  Return the
+    cells and the number of bytes decoded.
+    """
+    if selection is None:
+        selected = cells[start:end]
+        decoded = [json.loads(buf[first:last]) for first, last in selected]
+    else:
+        found = {}
+
+        def cell(i):
+            if i not in found:
+                found[i] = json.loads(buf[slice(*cells[i])])
+            return found[i]
+
+        def contains(i, text):
+            return buf.find(text.encode(), *cells[i]) >= 0
+
+        indices = select_cells(len(cells), selection, cell, contains)
+        selected = [cells[i] for i in indices]
+        decoded = [cell(i) for i in indices]
+    return decoded, sum(last - first for first, last in selected)
+
+
+# memory taken by the span of a cell in a notebook index
+_SPAN_SIZE = 120
 
-        return nbc, resources
 
-    call = preprocess  # IPython < 2.0
+class FileChangedError(OSError):
+    """The file of a notebook index changed since it was indexed"""
+
+
+class NotebookIndex:
+    """A notebook file, parsed to read slices of it
+
+    The cells of nbformat 4 files are located but not decoded: slices are
+    decoded from the file when they are read.  Other files are parsed whole.
+    ``decoded`` is the number of bytes of the file parsed for the index.
+    """
+
+    def __init__(self, path, signature, decoded, fields=None, cells=None, nb=None):
+        self.path = path
+        self.signature = signature
+        self.decoded = decoded
+        self.fields = fields
+        self.cells = cells
+        self.nb = nb
+
+    @property
+    def size(self):
+        """Approximate memory held by the index"""
+        return self.decoded + _SPAN_SIZE * len(self.cells or ())
+
+    def read(self, start=0, end=None, selection=None):
+        """Return ``cells[start:end]``, or the ``selection``, and its size
+
+        The size is the number of bytes of the file that were decoded.
+        """
+        import nbformat
+
+        if self.nb is not None:
+            if selection is None:
+                return slice_cells(self.nb, start, end), self.decoded
+            cells = self.nb.cells
+            nbc = type(self.nb)(self.nb)
+            nbc.cells = [
+                cells[i] for i in select_cells(len(cells), selection, cells.__getitem__)
+            ]
+            return nbc, self.decoded
+
+        with open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if (stat.st_mtime_ns, stat.st_size) != self.signature:
+                raise FileChangedError(self.path)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                cells, size = decode_cells(buf, self.cells, start, end, selection)
+        fields = dict(self.fields, cells=cells)
+        nb = nbformat.versions[4].to_notebook_json(
+            fields, minor=fields["nbformat_minor"]
+        )
+        try:
+            nbformat.validate(nb)
+        except nbformat.ValidationError as e:
+            logger.error("Notebook JSON is invalid: %s", e)
+        return nb, self.decoded + size
+
+
+def index_notebook(path):
+    """Parse the notebook at ``path`` into a ``NotebookIndex``"""
+    import nbformat
+
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        signature = (stat.st_mtime_ns, stat.st_size)
+        scanned = None
+        if stat.st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                try:
+                    scanned = scan_notebook(buf)
+                except ValueError:
+                    # let nbformat report malformed files
+                    scanned = None
+        if scanned is None:
+            text = f.read().decode("utf-8")
+            nb = nbformat.reads(text, as_version=4)
+            return NotebookIndex(path, signature, len(text), nb=nb)
+    fields, cells, decoded = scanned
+    return NotebookIndex(path, signature, decoded, fields, cells)
+
+
+def read_notebook(path, start=0, end=None, selection=None):
+    """Read ``cells[start:end]`` of a notebook; return it and its size
+
+    With ``selection``, the cells it picks are read instead.
+
+    The size is the number of bytes of the file that were decoded.
+    """
+    return index_notebook(path).read(start, end, selection)
+
+
+notebooks = NotebookStore(LT_CONFIG["NOTEBOOK_STORE_MAX_SIZE"])
+
+
+# ----------------------------------------------------------------------
+# Output images:
+#  with NOTEBOOK_IMAGES, image outputs are written to NOTEBOOK_IMAGES_DIR in
+#  the output directory, named after the hash of their contents, and the
+#  template references them instead of inlining them as base64.  Only the
+#  image a cell would display is written.  With LIQUID_TAGS_CACHE a copy is
+#  kept in CACHE_PATH, to restore images referenced by cached tags.  With
+#  LIQUID_TAGS_PREFETCH, conversions start before Pelican cleans the output
+#  directory, so files are written to a staging directory in CACHE_PATH
+#  instead and copied to the output once all content is read.
+IMAGES_CACHE_DIR = "liquid_tags_images"
+OUTPUTS_CACHE_DIR = "liquid_tags_outputs"
+STAGING_DIR = "liquid_tags_staging"
+
+# image types in the order the exporter prefers them
+_IMAGE_TYPES = {"image/svg+xml": "svg", "image/png": "png", "image/jpeg": "jpg"}
+# outputs with one of these are not displayed as an image
+_RICHER_TYPES = (
+    "application/vnd.jupyter.widget-view+json",
+    "application/javascript",
+    "text/html",
+    "text/markdown",
+)
+
+
+class FileWriter:
+    """Writes files once under content-hash names and returns their URLs"""
+
+    def __init__(self, directory, url, cache_dir=None):
+        self.directory = directory
+        self.url = url
+        self.cache_dir = cache_dir
+
+    def args(self):
+        return [self.directory, self.url, self.cache_dir]
+
+    def write(self, data, ext):
+        name = "{}.{}".format(hashlib.sha256(data).hexdigest()[:32], ext)
+        for directory in filter(None, (self.directory, self.cache_dir)):
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=directory, prefix=".")
+                with os.fdopen(fd, "wb") as fh:
+                    fh.write(data)
+                os.replace(tmp, path)
+        return f"{self.url}/{name}"
+
+    def lazy(self, body):
+        """Make the browser load the written images lazily"""
+        written = re.compile(r'<img (?=[^>]*src="%s/)' % re.escape(self.url))
+        return written.sub('<img loading="lazy" ', body)
+
+
+def image_size(data):
+    """Return ``(width, height)`` of PNG or JPEG ``data``, or None"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+        return struct.unpack(">II", data[16:24])
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 <= len(data) and data[i] == 0xFF:
+            marker = data[i + 1]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", data[i + 5 : i + 9])
+                return width, height
+            i += 2 + struct.unpack(">H", data[i + 2 : i + 4])[0]
+    return None
+
+
+def externalize_images(nb, images):
+    """Return a copy of ``nb`` whose image outputs are written by ``images``
+
+    Cells without images are shared with ``nb``, which is left unchanged.
+    """
+    cells = []
+    for cell in nb.cells:
+        outputs = cell.get("outputs")
+        if outputs and any(_displayed_image(output) for output in outputs):
+            cell = type(cell)(
+                cell, outputs=[_externalize(output, images) for output in outputs]
+            )
+        cells.append(cell)
+    nbc = type(nb)(nb)
+    nbc.cells = cells
+    return nbc
+
+
+def _displayed_image(output):
+    data = output.get("data") or {}
+    if any(mimetype in data for mimetype in _RICHER_TYPES):
+        return None
+    for mimetype in _IMAGE_TYPES:
+        if data.get(mimetype):
+            return mimetype
+    return None
+
+
+def _externalize(output, images):
+    mimetype = _displayed_image(output)
+    if mimetype is None:
+        return output
+    node = type(output)
+    output = node(output)
+    data = output.data[mimetype]
+    # the template does not read the data once the image has a file
+    output.data = node(output.data, **{mimetype: ""})
+    if mimetype == "image/svg+xml":
+        output.svg_filename = images.write(data.encode("utf-8"), "svg")
+        return output
+
+    raw = base64.b64decode(data)
+    metadata = node(output.get("metadata") or {})
+    filenames = node(metadata.get("filenames") or {})
+    filenames[mimetype] = images.write(raw, _IMAGE_TYPES[mimetype])
+    metadata.filenames = filenames
+    size = metadata.get(mimetype) or {}
+    if "width" not in size and "height" not in size:
+        dimensions = image_size(raw)
+        if dimensions:
+            metadata[mimetype] = node(size, width=dimensions[0], height=dimensions[1])
+    output.metadata = metadata
+    return output
+
+
+def restore_files(generators):
+    """Copy the files of cached and prerendered tags missing from the output"""
+    settings = generators[0].settings if generators else {}
+    staging = None
+    if settings.get("LIQUID_TAGS_PREFETCH"):
+        staging = os.path.join(settings["CACHE_PATH"], STAGING_DIR)
+    if staging is None and not settings.get("LIQUID_TAGS_CACHE"):
+        return
+    for setting, cache_dir, extensions in (
+        ("NOTEBOOK_IMAGES_DIR", IMAGES_CACHE_DIR, "svg|png|jpg"),
+        ("NOTEBOOK_OUTPUTS_DIR", OUTPUTS_CACHE_DIR, "txt"),
+    ):
+        directory = settings.get(setting, LT_CONFIG[setting]).strip("/")
+        output = os.path.join(settings["OUTPUT_PATH"], directory)
+        sources = []
+        if staging is not None:
+            sources.append(os.path.join(staging, directory))
+        if settings.get("LIQUID_TAGS_CACHE"):
+            sources.append(os.path.join(settings["CACHE_PATH"], cache_dir))
+        pattern = re.compile(
+            r"%s/([0-9a-f]{32}\.(?:%s))\b" % (re.escape(directory), extensions)
+        )
+        names = set()
+        for content in iter_contents(generators):
+            names.update(pattern.findall(getattr(content, "_content", None) or ""))
+        for name in names:
+            if not os.path.exists(os.path.join(output, name)):
+                for source in sources:
+                    if os.path.exists(os.path.join(source, name)):
+                        break
+                try:
+                    os.makedirs(output, exist_ok=True)
+                    shutil.copyfile(
+                        os.path.join(source, name), os.path.join(output, name)
+                    )
+                except OSError as e:
+                    logger.warning("Could not restore notebook file %s: %s", name, e)
+    if staging is not None:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+# ----------------------------------------------------------------------
+# Bounding outputs:
+#  widget state and data the exporter does not display only slow down the
+#  conversion.  Outputs beyond the size budgets are cut, and the full text
+#  is written to a separate file.
+# the display priority of the exporter, less the widget views, which need
+# the widget state
+_DISPLAYED_TYPES = frozenset(
+    (
+        "application/javascript",
+        "text/html",
+        "text/markdown",
+        "image/svg+xml",
+        "text/vnd.mermaid",
+        "text/latex",
+        "image/png",
+        "image/jpeg",
+        "text/plain",
+    )
+)
+
+_TRUNCATED = (
+    '<div class="liquid-tags-truncated">Output truncated to {shown} of {total}'
+    ' lines. <a href="{url}">Full output</a></div>'
+)
+_OMITTED = '<div class="liquid-tags-truncated">Output of {size} bytes omitted.</div>'
+
+
+class OutputLimits:
+    """Budgets for the size of the outputs of each cell and of a notebook
+
+    A budget of 0 is unlimited.  ``files`` writes the full text of the
+    outputs that are cut.
+    """
+
+    def __init__(self, cell_max_size, max_size, files):
+        self.cell_max_size = cell_max_size
+        self.max_size = max_size
+        self.files = files
+
+    def args(self):
+        return [self.cell_max_size, self.max_size, self.files.args()]
+
+
+def prune_outputs(nb, limits=None):
+    """Return a copy of ``nb`` without undisplayed data and within ``limits``
+
+    Unchanged cells are shared with ``nb``, which is left unchanged.
+    """
+    nbc = type(nb)(nb)
+    if "widgets" in nb.metadata:
+        nbc.metadata = type(nb.metadata)(nb.metadata)
+        del nbc.metadata["widgets"]
+
+    unlimited = float("inf")
+    left = unlimited
+    if limits is not None and limits.max_size:
+        left = limits.max_size
+    cells = []
+    for cell in nb.cells:
+        outputs = cell.get("outputs")
+        if outputs:
+            cell_left = left
+            if limits is not None and limits.cell_max_size:
+                cell_left = min(left, limits.cell_max_size)
+            pruned = []
+            for output in outputs:
+                output = _displayed_data(output)
+                if output is None:
+                    continue
+                size = _output_size(output)
+                if size > cell_left:
+                    shown, size = _cut(output, cell_left, limits.files)
+                    pruned.extend(shown)
+                else:
+                    pruned.append(output)
+                cell_left -= size
+                left -= size
+            if len(pruned) != len(outputs) or any(
+                a is not b for a, b in zip(pruned, outputs)
+            ):
+                cell = type(cell)(cell, outputs=pruned)
+        cells.append(cell)
+    nbc.cells = cells
+    return nbc
+
+
+def _displayed_data(output):
+    """Return ``output`` without the data types the exporter ignores"""
+    data = output.get("data")
+    if data is None:
+        return output
+    displayed = {key: value for key, value in data.items() if key in _DISPLAYED_TYPES}
+    if len(displayed) == len(data):
+        return output
+    if not displayed:
+        return None
+    node = type(output)
+    return node(output, data=node(displayed))
+
+
+def _output_size(output):
+    size = len(output.get("text") or "")
+    size += sum(len(line) for line in output.get("traceback") or ())
+    for value in (output.get("data") or {}).values():
+        size += len(value) if isinstance(value, str) else len(json.dumps(value))
+    return size
+
+
+def _cut(output, budget, files):
+    """Cut ``output`` to ``budget`` characters; return the outputs and size"""
+    node = type(output)
+    marker = node(output_type="display_data", metadata=node())
+    data = output.get("data") or {}
+    if output.get("output_type") == "stream":
+        text = output.text
+    elif list(data) == ["text/plain"]:
+        text = data["text/plain"]
+    else:
+        marker.data = node({"text/html": _OMITTED.format(size=_output_size(output))})
+        return [marker], 0
+
+    head = text[: max(int(budget), 0)]
+    head = head[: head.rfind("\n") + 1]
+    url = files.write(text.encode("utf-8"), "txt")
+    total = text.count("\n") + (not text.endswith("\n"))
+    html = _TRUNCATED.format(shown=head.count("\n"), total=total, url=escape(url))
+    marker.data = node({"text/html": html})
+    if not head:
+        return [marker], 0
+    if "text" in output:
+        output = node(output, text=head)
+    else:
+        output = node(output, data=node({"text/plain": head}))
+    return [output, marker], len(head)
+
+
+# ----------------------------------------------------------------------
+# Highlighted sources:
+#  the same cell sources are highlighted again for every slice and every
+#  build.  Highlighted HTML is memoized on the source, the language and the
+#  pygments version; with LIQUID_TAGS_CACHE it is also kept in CACHE_PATH
+#  between builds.
+HIGHLIGHT_FILE = "liquid_tags_highlight.pickle"
+HIGHLIGHT_MAX_ENTRIES = 20000
+
+
+class HighlightCache:
+    """Highlighted HTML, evicted least recently used first"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loaded = set()
+        self._changed = False
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._changed = True
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def load(self, path):
+        """Add the entries saved in ``path``, once per process"""
+        if path in self._loaded:
+            return
+        self._loaded.add(path)
+        try:
+            with open(path, "rb") as fh:
+                saved = pickle.load(fh)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.debug("Discarding unreadable highlight cache %s: %s", path, e)
+            return
+        with self._lock:
+            # saved entries are older than the ones of this process
+            for key, html in reversed(list(saved.items())):
+                if key not in self._entries:
+                    self._entries[key] = html
+                    self._entries.move_to_end(key, last=False)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self, path):
+        """Write the entries to ``path`` if they changed"""
+        with self._lock:
+            if not self._changed:
+                return
+            data = pickle.dumps(dict(self._entries), protocol=pickle.HIGHEST_PROTOCOL)
+            self._changed = False
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+
+highlights = HighlightCache(HIGHLIGHT_MAX_ENTRIES)
+
+
+def save_highlights(pelican):
+    if pelican.settings.get("LIQUID_TAGS_CACHE"):
+        highlights.save(os.path.join(pelican.settings["CACHE_PATH"], HIGHLIGHT_FILE))
 
 
 # ----------------------------------------------------------------------
 # Custom highlighter:
 #  instead of using class='highlight', use class='highlight-ipynb'
+_formatter = HtmlFormatter(cssclass="highlight-ipynb")
+
+
 def custom_highlighter(source, language="ipython", metadata=None):
-    formatter = HtmlFormatter(cssclass="highlight-ipynb")
     if not language:
         language = "ipython"
-    output = _pygments_highlight(source, formatter, language)
-    return output.replace("<pre>", '<pre class="ipynb">')
+    key = cache.make_key(source, language, pygments_version)
+    output = highlights.get(key)
+    if output is None:
+        from nbconvert.filters.highlight import _pygments_highlight
+
+        output = _pygments_highlight(source, _formatter, language)
+        output = output.replace("<pre>", '<pre class="ipynb">')
+        highlights.set(key, output)
+    return output
+
+
+# ----------------------------------------------------------------------
+# Warm exporters:
+#  building an HTMLExporter loads its templates, which costs more than
+#  converting a typical slice of a notebook.  Idle exporters are kept per
+#  highlight language; an exporter is used by one tag at a time.
+_exporters = {}
+_exporters_lock = threading.Lock()
+
+
+def cache_fingerprint():
+    """Versions and templates the output of the notebook tag depends on"""
+    from jupyter_core.paths import jupyter_path
+
+    return (
+        cache.distribution_versions("nbconvert", "nbformat", "jinja2"),
+        cache.tree_signature(*jupyter_path("nbconvert", "templates")),
+    )
+
+
+def _exporter_config():
+    from traitlets.config import Config
+
+    return Config(
+        {
+            "CSSHTMLHeaderTransformer": {
+                "enabled": True,
+                "highlight_class": ".highlight-ipynb",
+            },
+        }
+    )
+
+
+def _new_exporter(language):
+    from nbconvert.exporters import HTMLExporter
+
+    c = _exporter_config()
+
+    # FIXME: doesn't use plugin as source of templates, see:
+    # https://github.com/pelican-plugins/liquid-tags/issues/3
+    exporter = HTMLExporter(
+        config=c,
+        filters={"highlight2html": partial(custom_highlighter, language=language)},
+    )
+    return exporter
+
+
+@contextmanager
+def exporter_for(language):
+    """Borrow an exporter highlighting ``language``"""
+    with _exporters_lock:
+        idle = _exporters.get(language)
+        exporter = idle.pop() if idle else None
+    if exporter is None:
+        exporter = _new_exporter(language)
+    try:
+        yield exporter
+    finally:
+        with _exporters_lock:
+            _exporters.setdefault(language, []).append(exporter)
+
+
+# ----------------------------------------------------------------------
+# Incremental export:
+#  with the render cache enabled, the HTML of each cell is cached on its own,
+#  keyed on the cell and the notebook metadata.  Cells missing from the cache
+#  are exported together, separated by raw cells holding a boundary string,
+#  and the body is stitched from the page around them and the cell fragments.
+_BOUNDARY = "liquid-tags-cell-" + uuid.uuid4().hex
+
+
+def _fragment_key(kind, language, nb, cell=None):
+    from nbconvert import __version__ as nbconvert_version
+
+    return cache.make_key(
+        "notebook",
+        kind,
+        language,
+        json.dumps(nb.metadata, sort_keys=True, default=str),
+        json.dumps(cell, sort_keys=True, default=str),
+        nbconvert_version,
+        cache.handler_fingerprint(notebook),
+    )
+
+
+def export_cells(exporter, language, nb, tag_cache):
+    """Export the cells of ``nb``, reusing the fragments in ``tag_cache``"""
+    import nbformat
+
+    frame_key = _fragment_key("frame", language, nb)
+    keys = [_fragment_key("cell", language, nb, cell) for cell in nb.cells]
+    frame = tag_cache.get(frame_key)
+    fragments = [tag_cache.get(key) for key in keys]
+    missing = [i for i, fragment in enumerate(fragments) if fragment is None]
+
+    if missing or frame is None:
+        boundary = nbformat.v4.new_raw_cell(
+            _BOUNDARY, metadata={"raw_mimetype": "text/html"}
+        )
+        batch = nbformat.NotebookNode(nb)
+        batch.cells = [boundary]
+        for i in missing:
+            batch.cells += [nb.cells[i], boundary]
+        body, _ = exporter.from_notebook_node(batch)
+
+        parts = body.split(_BOUNDARY)
+        if len(parts) != len(missing) + 2:
+            # the template did not keep the boundaries: export as a whole
+            return exporter.from_notebook_node(nb)[0]
+        frame = (parts[0], parts[-1])
+        tag_cache.set(frame_key, frame)
+        for i, fragment in zip(missing, parts[1:-1]):
+            fragments[i] = fragment
+            tag_cache.set(keys[i], fragment)
+
+    return frame[0] + "".join(fragments) + frame[1]
 
 
 # ----------------------------------------------------------------------
 # Below is the pelican plugin code.
 #
 SYNTAX = (
-    "{% notebook /path/to/notebook.ipynb [ cells[start:end] ] [ language[language] ] %}"
+    "{% notebook /path/to/notebook.ipynb [ cells[start:end] | cells[selection] ] "
+    "[ language[language] ] %}"
 )
 FORMAT = re.compile(
-    r"""^(\s+)?(?P<src>\S+)(\s+)?((cells\[)(?P<start>-?[0-9]*):(?P<end>-?[0-9]*)(\]))?(\s+)?((language\[)(?P<language>-?[a-z0-9\+\-]*)(\]))?(\s+)?$"""
+    r"""^(\s+)?(?P<src>\S+)(\s+)?((cells\[)(?:(?P<start>-?[0-9]*):(?P<end>-?[0-9]*)|(?P<cells>[^\]]+))(\]))?(\s+)?((language\[)(?P<language>-?[a-z0-9\+\-]*)(\]))?(\s+)?$"""
 )
 
 
-@LiquidTags.register("notebook")
-def notebook(preprocessor, tag, markup):
+def conversion_job(configs, markup):
+    """Return the conversion job of a tag and the objects it refers to
+
+    The job is a list of plain values that identifies the conversion, as
+    ``[nb_path, start, end, selection, language, store_size, cache_args,
+    image_args, limit_args]``.
+    """
     match = FORMAT.search(markup)
     if match:
         argdict = match.groupdict()
         src = argdict["src"]
         start = argdict["start"]
         end = argdict["end"]
+        selection = argdict["cells"]
         language = argdict["language"]
     else:
         raise ValueError(
@@ -287,82 +1082,118 @@ def notebook(preprocessor, tag, markup):
     else:
         end = None
 
-    language_applied_highlighter = partial(custom_highlighter, language=language)
-
-    nb_dir = preprocessor.configs.getConfig("NOTEBOOK_DIR")
-    nb_path = os.path.join(
-        preprocessor.configs.getConfig("PATH", "content"), nb_dir, src
-    )
+    nb_dir = configs.getConfig("NOTEBOOK_DIR")
+    nb_path = os.path.join(configs.getConfig("PATH", "content"), nb_dir, src)
 
     if not os.path.exists(nb_path):
         raise ValueError(f"File {nb_path} could not be found")
 
-    # Create the custom notebook converter
-    c = Config(
-        {
-            "CSSHTMLHeaderTransformer": {
-                "enabled": True,
-                "highlight_class": ".highlight-ipynb",
-            },
-            "SubCell": {"enabled": True, "start": start, "end": end},
-        }
-    )
+    tag_cache = configs.tag_cache()
+
+    output_path = configs.getConfig("OUTPUT_PATH")
+    if configs.getConfig("LIQUID_TAGS_PREFETCH"):
+        # conversions started at initialization would be deleted with the
+        # output directory; restore_files copies them in
+        output_path = os.path.join(configs.getConfig("CACHE_PATH"), STAGING_DIR)
+
+    images = None
+    if configs.getConfig("NOTEBOOK_IMAGES"):
+        images_dir = configs.getConfig("NOTEBOOK_IMAGES_DIR").strip("/")
+        images = FileWriter(
+            os.path.join(output_path, images_dir),
+            "{}/{}".format(configs.getConfig("SITEURL"), images_dir),
+            os.path.join(configs.getConfig("CACHE_PATH"), IMAGES_CACHE_DIR)
+            if tag_cache is not None
+            else None,
+        )
 
-    """
-    # FIXME: doesn't use plugin as source of templates, see:
-    # https://github.com/pelican-plugins/liquid-tags/issues/3
-    template_file = "basic"
-    if IPYTHON_VERSION >= 3:
-        if os.path.exists("pelicanhtml_3.tpl"):
-            template_file = "pelicanhtml_3"
-    elif IPYTHON_VERSION == 2:
-        if os.path.exists("pelicanhtml_2.tpl"):
-            template_file = "pelicanhtml_2"
+    limits = None
+    cell_max_size = configs.getConfig("NOTEBOOK_CELL_OUTPUT_MAX_SIZE")
+    max_size = configs.getConfig("NOTEBOOK_OUTPUT_MAX_SIZE")
+    if cell_max_size or max_size:
+        outputs_dir = configs.getConfig("NOTEBOOK_OUTPUTS_DIR").strip("/")
+        files = FileWriter(
+            os.path.join(output_path, outputs_dir),
+            "{}/{}".format(configs.getConfig("SITEURL"), outputs_dir),
+            os.path.join(configs.getConfig("CACHE_PATH"), OUTPUTS_CACHE_DIR)
+            if tag_cache is not None
+            else None,
+        )
+        limits = OutputLimits(cell_max_size, max_size, files)
+
+    cache_args = None
+    if tag_cache is not None:
+        cache_args = [tag_cache.path, tag_cache.max_size, tag_cache.max_entries]
+        # jobs run in this process share the cache of the extension
+        _worker_caches[tuple(cache_args)] = tag_cache
+
+    job = [
+        os.path.abspath(nb_path),
+        start,
+        end,
+        selection.strip() if selection else None,
+        language,
+        configs.getConfig("NOTEBOOK_STORE_MAX_SIZE"),
+        cache_args,
+        images.args() if images is not None else None,
+        limits.args() if limits is not None else None,
+    ]
+    return job, tag_cache, images, limits
+
+
+@remote
+def prerender(payload):
+    """Convert the notebook of a tag ahead of the reader"""
+    return _convert_job(payload)
+
+
+@prefetcher("notebook")
+def prefetch_notebook(configs, markup):
+    if configs.cached_render(notebook, "notebook", markup)[1] is not None:
+        # the reader will use the cached page
+        return
+    job, _, _, _ = conversion_job(configs, markup)
+    payload = json.dumps(job).encode().hex()
+    processes = configs.getConfig("NOTEBOOK_PROCESSES")
+    if processes:
+        # conversion is CPU-bound: keep it off the prefetch threads
+        submit(payload, processes)
     else:
-        if os.path.exists("pelicanhtml_1.tpl"):
-            template_file = "pelicanhtml_1"
-    """
+        yield prerender, (payload,)
 
-    if IPYTHON_VERSION >= 2:
-        subcell_kwarg = dict(preprocessors=[SubCell])
-    else:
-        subcell_kwarg = dict(transformers=[SubCell])
 
-    exporter = HTMLExporter(
-        config=c,
-        # template_file=template_file,
-        filters={"highlight2html": language_applied_highlighter},
-        **subcell_kwarg,
-    )
+@LiquidTags.register("notebook")
+def notebook(preprocessor, tag, markup):
+    job, tag_cache, images, limits = conversion_job(preprocessor.configs, markup)
+    nb_path, start, end, selection, language, store_size = job[:6]
+    add_dependency(nb_path)
 
-    # read and parse the notebook
-    with open(nb_path, encoding="utf-8") as f:
-        nb_text = f.read()
-        if IPYTHON_VERSION < 3:
-            nb_json = IPython.nbformat.current.reads_json(nb_text)
-        else:
-            try:
-                nb_json = nbformat.reads(nb_text, as_version=4)
-            except NameError:
-                nb_json = IPython.nbformat.reads(nb_text, as_version=4)
-
-    (body, resources) = exporter.from_notebook_node(nb_json)
-
-    # if we haven't already saved the header, save it here.
-    if not notebook.header_saved:
-        print(
-            "\n ** Writing styles to _nb_header.html: "
-            "this should be included in the theme. **\n"
+    if tag_cache is not None:
+        highlights.load(
+            os.path.join(preprocessor.configs.getConfig("CACHE_PATH"), HIGHLIGHT_FILE)
         )
 
-        header = "\n".join(
-            CSS_WRAPPER.format(css_line) for css_line in resources["inlining"]["css"]
-        )
-        header += JS_INCLUDE
+    payload = json.dumps(job).encode().hex()
+    processes = preprocessor.configs.getConfig("NOTEBOOK_PROCESSES")
+    if processes:
+        submit(payload, processes)
+        return preprocessor.configs.htmlStash.store(_PLACEHOLDER.format(payload))
 
-        with open("_nb_header.html", "w") as f:
-            f.write(header)
-        notebook.header_saved = True
+    if preprocessor.configs.getConfig("LIQUID_TAGS_PREFETCH"):
+        # picks up the conversion started when Pelican was initialized
+        body = prerender(payload)
+    else:
+        body = convert(
+            nb_path,
+            start,
+            end,
+            language,
+            tag_cache,
+            images,
+            limits,
+            selection,
+            store_size,
+        )
 
     # this will stash special characters so that they won't be transformed
     # by subsequent processes.
@@ -370,9 +1201,276 @@ def notebook(preprocessor, tag, markup):
     return body
 
 
-notebook.header_saved = False
+def convert(
+    nb_path,
+    start,
+    end,
+    language,
+    tag_cache=None,
+    images=None,
+    limits=None,
+    selection=None,
+    store_size=None,
+):
+    """Convert ``cells[start:end]``, or the ``selection``, of a notebook to HTML
+
+    ``store_size`` bounds the parsed notebooks kept by ``notebooks``.
+    """
+    # slice before exporting: the exporter deep-copies the notebook it is given
+    nb = notebooks.get(nb_path, start, end, selection, store_size)
+    nb_json = prune_outputs(nb, limits)
+    if images is not None:
+        nb_json = externalize_images(nb_json, images)
+    with exporter_for(language) as exporter:
+        if tag_cache is not None:
+            body = export_cells(exporter, language, nb_json, tag_cache)
+        else:
+            body, _ = exporter.from_notebook_node(nb_json)
+    if images is not None:
+        body = images.lazy(body)
+    # Markdown strips the end of a document; stripping the body too makes
+    # pooled conversions, substituted in the HTML, match wherever the tag is
+    return body.rstrip()
+
+
+# ----------------------------------------------------------------------
+# Header:
+#  the styles of converted notebooks do not depend on their content.  They
+#  are written once per build to a stylesheet named after its content, and
+#  ``_nb_header.html`` links to it for inclusion in the theme.
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_PUNCTUATION = re.compile(r" ?([{};,>]) ?")
+_CSS_STATEMENT = re.compile(r"[{};]")
+
+
+def minify_css(css):
+    """Strip the comments and spaces of ``css`` and drop repeated rules"""
+    css = _CSS_COMMENT.sub("", css)
+    css = _CSS_SPACE.sub(" ", css)
+    css = _CSS_PUNCTUATION.sub(r"\1", css).replace(": ", ":").replace(";}", "}")
+
+    statements = []
+    depth = start = 0
+    for match in _CSS_STATEMENT.finditer(css):
+        if match.group() == "{":
+            depth += 1
+        elif match.group() == "}":
+            depth -= 1
+        if not depth and match.group() != "{":
+            statements.append(css[start : match.end()].strip())
+            start = match.end()
+    statements.append(css[start:].strip())
+    # a repeated rule overrides everything in between: keep the last one
+    unique = list(dict.fromkeys(reversed([s for s in statements if s.strip(";")])))
+    return "".join(reversed(unique))
+
+
+def notebook_styles():
+    """Return the minified stylesheet of converted notebooks"""
+    from jupyter_core.paths import jupyter_config_dir
+    from nbconvert.preprocessors import CSSHTMLHeaderPreprocessor
+    import nbformat
+
+    # the styles the exporter inlines, without exporting a notebook
+    header = CSSHTMLHeaderPreprocessor(config=_exporter_config())
+    _, resources = header.preprocess(
+        nbformat.v4.new_notebook(), {"config_dir": jupyter_config_dir()}
+    )
+    return minify_css("\n".join(resources["inlining"]["css"] + [NOTEBOOK_CSS]))
+
+
+_NOTEBOOK_CONTENT = re.compile(r'class="jp-Notebook|<!--liquid-tags-notebook:')
+# the markup math extensions render (``class="math"`` for render_math and
+# python-markdown-math, ``arithmatex`` for pymdownx, ``math/tex`` scripts) and
+# closed ``\(...\)`` or ``\[...\]`` pairs; bare dollars are left out, as prose
+# uses them for prices far more often than for math
+_MATH = re.compile(
+    r'class="(?:[^"]*\s)?(?:math|arithmatex)[\s"]|type="math/tex'
+    r"|\\\(.+?\\\)|\\\[.+?\\\]",
+    re.DOTALL,
+)
+
+
+def write_header(generators):
+    """Write the notebook stylesheet and ``_nb_header.html``
+
+    Content showing a notebook gets the header in its ``notebook_header``
+    attribute, and content with math only the MathJax scripts, so that themes
+    can include them in those pages only.
+    """
+    settings = generators[0].settings if generators else LT_CONFIG
+    styles_dir = settings.get("NOTEBOOK_STYLES_DIR", LT_CONFIG["NOTEBOOK_STYLES_DIR"])
+    styles_dir = styles_dir.strip("/")
+    files = FileWriter(
+        os.path.join(settings.get("OUTPUT_PATH", "output"), styles_dir),
+        "{}/{}".format(settings.get("SITEURL", ""), styles_dir),
+    )
+    header_file = settings.get("NOTEBOOK_HEADER_FILE", HEADER_FILE)
+    url = files.write(notebook_styles().encode("utf-8"), "css")
+    header = '<link rel="stylesheet" href="{}">\n{}'.format(escape(url), JS_INCLUDE)
+
+    for content in iter_contents(generators):
+        text = getattr(content, "_content", None) or ""
+        if _NOTEBOOK_CONTENT.search(text):
+            content.notebook_header = header
+        elif _MATH.search(text):
+            content.notebook_header = MATHJAX_INCLUDE
+
+    try:
+        with open(header_file, encoding="utf-8") as f:
+            if f.read() == header:
+                return
+    except OSError:
+        pass
+    print(
+        f"\n ** Writing styles to {header_file}: "
+        "this should be included in the theme. **\n"
+    )
+    with open(header_file, "w", encoding="utf-8") as f:
+        f.write(header)
+
+
+# ----------------------------------------------------------------------
+# Conversion in a process pool:
+#  with NOTEBOOK_PROCESSES set, the tag submits the conversion to a pool of
+#  processes and leaves a placeholder in the document.  The placeholder
+#  encodes the conversion, so that documents restored from Pelican's content
+#  cache can be completed too.  Placeholders are replaced in all content once
+#  every generator has read its content, before anything is written.
+_PLACEHOLDER = "<!--liquid-tags-notebook:{}-->"
+_PLACEHOLDER_RE = re.compile(r"<!--liquid-tags-notebook:([0-9a-f]+)-->")
+
+# generator attributes holding content objects
+_CONTENT_LISTS = (
+    "articles",
+    "translations",
+    "drafts",
+    "drafts_translations",
+    "hidden_articles",
+    "hidden_translations",
+    "pages",
+    "hidden_pages",
+    "draft_pages",
+    "draft_translations",
+)
+
+
+def iter_contents(generators):
+    """Yield the content objects of all generators"""
+    for generator in generators:
+        for name in _CONTENT_LISTS:
+            yield from getattr(generator, name, None) or ()
+
+
+_conversions = {}
+_pool = None
+_pool_lock = threading.Lock()
+# render caches by their arguments, in this process
+_worker_caches = {}
+
+
+def submit(payload, processes):
+    """Start the conversion encoded in ``payload``; return its future"""
+    global _pool
+    with _pool_lock:
+        if payload not in _conversions:
+            if _pool is None:
+                # fork would copy the threads of the reader into the workers
+                _pool = ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            _conversions[payload] = _pool.submit(_convert_job, payload)
+        return _conversions[payload]
+
+
+def _convert_job(payload):
+    """Run the conversion encoded in ``payload``; return the body"""
+    (
+        nb_path,
+        start,
+        end,
+        selection,
+        language,
+        store_size,
+        cache_args,
+        image_args,
+        limit_args,
+    ) = json.loads(bytes.fromhex(payload))
+    tag_cache = None
+    if cache_args:
+        key = tuple(cache_args)
+        if key not in _worker_caches:
+            _worker_caches[key] = cache.TagCache(*key)
+        tag_cache = _worker_caches[key]
+        highlights.load(os.path.join(os.path.dirname(key[0]), HIGHLIGHT_FILE))
+    images = FileWriter(*image_args) if image_args else None
+    limits = None
+    if limit_args:
+        limits = OutputLimits(*limit_args[:2], FileWriter(*limit_args[2]))
+    return convert(
+        nb_path,
+        start,
+        end,
+        language,
+        tag_cache,
+        images,
+        limits,
+        selection,
+        store_size,
+    )
+
+
+def resolve_conversions(generators):
+    """Replace the placeholders of pooled conversions in all content"""
+    contents = {}
+    for content in iter_contents(generators):
+        if _PLACEHOLDER_RE.search(getattr(content, "_content", None) or ""):
+            contents[id(content)] = content
+    if not contents:
+        return
+
+    processes = generators[0].settings.get("NOTEBOOK_PROCESSES") or None
+    for content in contents.values():
+        for payload in _PLACEHOLDER_RE.findall(content._content):
+            submit(payload, processes)
+
+    results = {}
+    try:
+        for content in contents.values():
+            text = content._content
+            for payload in set(_PLACEHOLDER_RE.findall(text)):
+                if payload not in results:
+                    try:
+                        results[payload] = _conversions[payload].result()
+                    except Exception as e:
+                        nb_path = json.loads(bytes.fromhex(payload))[0]
+                        logger.error("Could not convert notebook %s: %s", nb_path, e)
+                        results[payload] = ""
+                text = text.replace(_PLACEHOLDER.format(payload), results[payload])
+            content._content = text
+    finally:
+        shutdown()
+
+
+def shutdown():
+    """Stop the conversion processes"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            # shutdown(cancel_futures=True) needs Python 3.9
+            for future in _conversions.values():
+                future.cancel()
+            _pool.shutdown(wait=True)
+            _pool = None
+        _conversions.clear()
 
 
 # ----------------------------------------------------------------------
 # This import allows notebook to be a Pelican plugin
-from .liquid_tags import register  # noqa
+from .liquid_tags import finalizeNotebooks, register, saveNotebookHighlights  # noqa
+
+# the plugin connects these handlers when notebook is in LIQUID_TAGS
+signals.all_generators_finalized.connect(finalizeNotebooks)
+signals.finalized.connect(saveNotebookHighlights)
@@ -0,0 +1,170 @@
+"""
+Prefetching Remote Resources
+----------------------------
+Tags such as ``flickr`` or ``giphy`` query a web API for every occurrence,
+while Pelican reads one article after another.  With
+
+    LIQUID_TAGS_PREFETCH = True
+
+all Markdown sources Pelican reads are scanned for liquid tags when it is
+initialized, and the remote requests of every tag that registered a
+prefetcher are started at once on a pool of
+``LIQUID_TAGS_PREFETCH_WORKERS`` threads.  When the reader reaches a tag,
+its handler picks up the response from memory instead of waiting for the
+network.
+
+A tag supports prefetching by decorating its network functions with
+``remote`` and registering a prefetcher that returns the calls its handler
+will make for a given markup:
+
+    @remote
+    def get_info(photo_id, api_key):
+        ...
+
+    @prefetcher("flickr")
+    def prefetch_flickr(configs, markup):
+        yield get_info, (photo_id, configs.getConfig("FLICKR_API_KEY"))
+"""
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import functools
+import logging
+import os
+import threading
+
+from .mdx_liquid_tags import iter_tags, load_tag
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_EXTENSIONS = (".md", ".markdown", ".mkd", ".mdown")
+
+_prefetchers = {}
+_results = {}
+_lock = threading.Lock()
+
+
+def prefetcher(tag):
+    """Decorator to register the prefetcher of a tag"""
+
+    def dec(func):
+        _prefetchers[tag] = func
+        return func
+
+    return dec
+
+
+def remote(func):
+    """Decorator serving calls of ``func`` from prefetched results
+
+    Calls that were not prefetched, or whose prefetch failed, go to the
+    network as usual.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        with _lock:
+            future = _results.get((wrapper, args))
+        if future is not None:
+            try:
+                return future.result()
+            except Exception as e:
+                logger.debug("Prefetch of %s%r failed: %s", func.__name__, args, e)
+        return func(*args)
+
+    return wrapper
+
+
+def iter_sources(path, exclude=(), paths=("",), ignore=()):
+    """Yield the paths of all Markdown files below ``path``
+
+    Like Pelican's generators, only the directories ``paths`` are searched,
+    and the directories of ``exclude`` as well as the files and directories
+    matching a glob pattern of ``ignore`` are skipped; both are relative to
+    ``path``.
+    """
+    exclude = {os.path.abspath(os.path.join(path, p)) for p in exclude}
+
+    def ignored(name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in ignore)
+
+    for top in paths:
+        for root, dirs, files in os.walk(
+            os.path.join(path, top) if top else path, followlinks=True
+        ):
+            dirs[:] = [
+                d
+                for d in dirs
+                if not d.startswith(".")
+                and not ignored(d)
+                and os.path.abspath(os.path.join(root, d)) not in exclude
+            ]
+            for name in files:
+                if name.lower().endswith(MARKDOWN_EXTENSIONS) and not ignored(name):
+                    yield os.path.join(root, name)
+
+
+def content_sources(settings):
+    """Return the Markdown files Pelican reads as articles or pages"""
+    build = [settings["OUTPUT_PATH"], settings["CACHE_PATH"]]
+    sources = set()
+    for kind in ("ARTICLE", "PAGE"):
+        sources.update(
+            iter_sources(
+                settings["PATH"],
+                build + list(settings.get(kind + "_EXCLUDES", [])),
+                settings.get(kind + "_PATHS", [""]),
+                settings.get("IGNORE_FILES", []),
+            )
+        )
+    return sorted(sources)
+
+
+def iter_source_tags(path, exclude=(), sources=None):
+    """Yield ``(source, tag, markup)`` for every liquid tag below ``path``
+
+    ``sources`` overrides the files scanned.
+    """
+    if sources is None:
+        sources = iter_sources(path, exclude)
+    for source in sources:
+        try:
+            with open(source, encoding="utf-8") as fh:
+                page = fh.read()
+        except (OSError, UnicodeDecodeError) as e:
+            logger.debug("Not scanning %s for liquid tags: %s", source, e)
+            continue
+        if "{%" in page:
+            for tag, markup in iter_tags(page):
+                yield source, tag, markup
+
+
+def start(configs, path, exclude=(), sources=None):
+    """Submit the remote calls of every prefetchable tag below ``path``"""
+    pool = ThreadPoolExecutor(
+        max_workers=configs.getConfig("LIQUID_TAGS_PREFETCH_WORKERS"),
+        thread_name_prefix="liquid-tags-prefetch",
+    )
+    count = 0
+    for _, tag, markup in iter_source_tags(path, exclude, sources):
+        # importing the module of a lazily loaded tag registers its prefetcher
+        load_tag(tag)
+        if tag not in _prefetchers:
+            continue
+        try:
+            calls = list(_prefetchers[tag](configs, markup))
+        except Exception:
+            # malformed markup: the handler reports it when the page is read
+            continue
+        with _lock:
+            for func, args in calls:
+                if (func, args) not in _results:
+                    _results[func, args] = pool.submit(func.__wrapped__, *args)
+                    count += 1
+    pool.shutdown(wait=False)
+    logger.info("Prefetching %d remote resources for liquid tags", count)
+
+
+def clear(*args):
+    """Drop all prefetched results"""
+    with _lock:
+        _results.clear()
@@ -0,0 +1,72 @@
+"""
+Profiling Tags
+--------------
+Runs selected tag handlers under ``cProfile`` and writes one ``.pstats`` file
+per rendering to ``liquid_tags_profiles`` in the ``CACHE_PATH`` directory:
+
+    LIQUID_TAGS_PROFILE = ["notebook", "blockdiag"]  # or True for all tags
+    LIQUID_TAGS_PROFILE_PATHS = ["*/big-analysis.md"]  # optional glob filter
+
+Files are named after the path of the source document relative to the
+content directory and the position of the tag in it, e.g.
+``posts/big-analysis-003-notebook.pstats``, and can be inspected with
+
+    python -m pstats cache/liquid_tags_profiles/posts/big-analysis-003-notebook.pstats
+
+Only synchronous handlers are profiled: the time an ``async def`` handler
+spends waiting would be mixed up with the other tags of the document.
+"""
+import cProfile
+import fnmatch
+import hashlib
+import os
+import threading
+
+PROFILE_DIR = "liquid_tags_profiles"
+
+
+class TagProfiler:
+    """Decides which tags to profile and runs them under cProfile"""
+
+    def __init__(self, directory, tags=True, paths=(), root="content"):
+        self.directory = directory
+        if isinstance(tags, str):
+            tags = [tags]
+        self.tags = None if tags is True else set(tags)
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.root = root
+        # only one profiler can be active at a time on recent Pythons
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def wants(self, tag, source):
+        """Whether the rendering of ``tag`` in ``source`` should be profiled"""
+        if self.tags is not None and tag not in self.tags:
+            return False
+        if self.paths:
+            return source is not None and any(
+                fnmatch.fnmatch(source, pattern) for pattern in self.paths
+            )
+        return True
+
+    def filename(self, tag, source, index):
+        """Path of the profile of the ``index``-th tag of ``source``"""
+        source = source or "unknown"
+        stem = os.path.splitext(os.path.relpath(source, self.root))[0]
+        if stem.startswith(os.pardir):
+            # outside of the content directory: tell apart equal names
+            folder = os.path.dirname(os.path.abspath(source))
+            digest = hashlib.sha1(folder.encode()).hexdigest()[:8]
+            stem = "{}-{}".format(os.path.basename(stem), digest)
+        filename = os.path.join(self.directory, f"{stem}-{index:03d}-{tag}.pstats")
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        return filename
+
+    def call(self, filename, func, *args):
+        """Run ``func(*args)`` under cProfile and dump its statistics"""
+        with self._lock:
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(func, *args)
+            finally:
+                profiler.dump_stats(filename)
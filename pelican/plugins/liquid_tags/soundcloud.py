@@ -31,7 +31,8 @@ import re
 # ---------------------------------------------------
 # This import allows soundcloud tag to be a Pelican plugin
 from .liquid_tags import register  # noqa
-from .mdx_liquid_tags import LiquidTags
+from .mdx_liquid_tags import LiquidTags, to_thread
+from .prefetch import prefetcher, remote
 
 try:
     from urllib.request import urlopen
@@ -44,6 +45,7 @@ PARSE_SYNTAX = re.compile(r"(?P<track_url>https?://soundcloud.com/[\S]+)")
 SOUNDCLOUD_API_URL = "https://soundcloud.com/oembed"
 
 
+@remote
 def get_widget(track_url):
     r = urlopen(SOUNDCLOUD_API_URL, data=f"format=json&url={track_url}".encode())
 
@@ -60,8 +62,13 @@ def match_it(markup):
         )
 
 
+@prefetcher("soundcloud")
+def prefetch_soundcloud(configs, markup):
+    yield get_widget, (match_it(markup)["track_url"],)
+
+
 @LiquidTags.register("soundcloud")
-def soundcloud(preprocessor, tag, markup):
+async def soundcloud(preprocessor, tag, markup):
     track_url = match_it(markup)["track_url"]
 
-    return get_widget(track_url)
+    return await to_thread(get_widget, track_url)
@@ -0,0 +1,153 @@
+"""
+Tag Statistics
+--------------
+Records how often each tag is rendered, how long it takes and how much
+output it produces, per tag and per source file.  Enable with any of:
+
+    LIQUID_TAGS_STATS = True                  # print a summary after the build
+    LIQUID_TAGS_STATS_FILE = "tag-stats.json" # write the full report as JSON
+    LIQUID_TAGS_SLOW_THRESHOLD = 2.0          # log tags slower than 2 seconds
+
+Cache hits and misses are counted when the render cache is enabled.  Tags
+without a handler are counted separately, as they are left unrendered.
+"""
+from collections import defaultdict
+import json
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class _Entry:
+    __slots__ = ("times", "bytes", "hits", "misses")
+
+    def __init__(self):
+        self.times = []
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, seconds, nbytes, cached):
+        self.times.append(seconds)
+        self.bytes += nbytes
+        if cached is True:
+            self.hits += 1
+        elif cached is False:
+            self.misses += 1
+
+    def summary(self):
+        return {
+            "count": len(self.times),
+            "total": sum(self.times),
+            "p95": percentile(self.times, 0.95),
+            "bytes": self.bytes,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+        }
+
+
+class TagStats:
+    """Collects timings of rendered tags"""
+
+    def __init__(self, slow_threshold=0):
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self._entries = defaultdict(_Entry)
+        self._unknown = defaultdict(int)
+
+    def record(self, tag, source, markup, seconds, nbytes, cached=None):
+        """Record one rendering; ``cached`` is None if caching is disabled"""
+        with self._lock:
+            self._entries[tag, source].add(seconds, nbytes, cached)
+        if self.slow_threshold and seconds > self.slow_threshold:
+            logger.warning(
+                "Slow liquid tag (%.2fs) in %s: {%% %s %s %%}",
+                seconds,
+                source or "<unknown>",
+                tag,
+                markup if len(markup) <= 200 else markup[:200] + "...",
+            )
+
+    def record_unknown(self, tag, source):
+        """Record a tag found in ``source`` that has no handler"""
+        with self._lock:
+            self._unknown[tag, source] += 1
+
+    def report(self):
+        """Return the statistics per tag and per tag and source"""
+        with self._lock:
+            entries = dict(self._entries)
+            unknown = dict(self._unknown)
+        by_tag = defaultdict(_Entry)
+        for (tag, _), entry in entries.items():
+            merged = by_tag[tag]
+            merged.times.extend(entry.times)
+            merged.bytes += entry.bytes
+            merged.hits += entry.hits
+            merged.misses += entry.misses
+        return {
+            "tags": {tag: entry.summary() for tag, entry in sorted(by_tag.items())},
+            "sources": [
+                dict(tag=tag, source=source, **entry.summary())
+                for (tag, source), entry in sorted(
+                    entries.items(), key=lambda item: (item[0][0], item[0][1] or "")
+                )
+            ],
+            "unknown": [
+                {"tag": tag, "source": source, "count": count}
+                for (tag, source), count in sorted(
+                    unknown.items(), key=lambda item: (item[0][0], item[0][1] or "")
+                )
+            ],
+        }
+
+    def format_table(self):
+        """Return the per-tag summary as a plain text table"""
+        header = ("tag", "calls", "total s", "p95 ms", "bytes", "hits", "misses")
+        rows = [
+            (
+                tag,
+                str(s["count"]),
+                "%.3f" % s["total"],
+                "%.1f" % (s["p95"] * 1000),
+                str(s["bytes"]),
+                str(s["cache_hits"]),
+                str(s["cache_misses"]),
+            )
+            for tag, s in sorted(
+                self.report()["tags"].items(), key=lambda item: -item[1]["total"]
+            )
+        ]
+        widths = [max(len(row[i]) for row in [header] + rows) for i in range(7)]
+        lines = [
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in [header] + rows
+        ]
+        lines.insert(1, "  ".join("-" * width for width in widths))
+
+        unknown = defaultdict(int)
+        for entry in self.report()["unknown"]:
+            unknown[entry["tag"]] += entry["count"]
+        if unknown:
+            lines.append(
+                "unknown tags: "
+                + ", ".join(
+                    f"{tag} ({count})" for tag, count in sorted(unknown.items())
+                )
+            )
+        return "\n".join(lines)
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(self.report(), fh, indent=2)
@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+
+from . import cache, notebook
+from .cache import TagCache, file_digest, make_key
+
+if "nosetests" in sys.argv[0]:
+    raise unittest.SkipTest("Those tests are pytest-compatible only")
+
+
+def test_roundtrip_and_persistence(tmp_path):
+    store = TagCache(str(tmp_path), max_size=1 << 20, max_entries=10)
+    key = make_key("img", "/a.png", [])
+    assert store.get(key) is None
+    store.set(key, ("<img>", [], []))
+    assert store.get(key) == ("<img>", [], [])
+
+    reopened = TagCache(str(tmp_path), max_size=1 << 20, max_entries=10)
+    assert reopened.get(key) == ("<img>", [], [])
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    store = TagCache(str(tmp_path), max_size=1 << 20, max_entries=2)
+    store.set("a", 1)
+    store.set("b", 2)
+    store.get("a")
+    store.set("c", 3)
+    assert store.get("b") is None
+    assert store.get("a") == 1
+    assert store.get("c") == 3
+    assert sorted(os.listdir(str(tmp_path))) == ["a", "c"]
+
+
+def test_size_limit(tmp_path):
+    store = TagCache(str(tmp_path), max_size=300, max_entries=100)
+    store.set("small", "x")
+    store.set("big", "x" * 1000)
+    store.set("medium", "x" * 200)
+    assert store.get("big") is None
+    assert store.get("small") == "x"
+    assert store.get("medium") == "x" * 200
+
+
+def test_unreadable_entry_is_discarded(tmp_path):
+    store = TagCache(str(tmp_path), max_size=1 << 20, max_entries=10)
+    store.set("key", "value")
+    with open(os.path.join(str(tmp_path), "key"), "wb") as fh:
+        fh.write(b"garbage")
+    assert store.get("key") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "key"))
+
+
+def test_file_digest(tmp_path):
+    path = tmp_path / "code.py"
+    path.write_text("print(1)\n")
+    first = file_digest(str(path))
+    path.write_text("print(22)\n")
+    assert file_digest(str(path)) != first
+    assert file_digest(str(tmp_path / "missing")) is None
+
+
+def test_handler_fingerprint_covers_dependencies(monkeypatch):
+    monkeypatch.setattr(cache, "_fingerprints", {})
+    first = cache.handler_fingerprint(notebook.notebook)
+    monkeypatch.setattr(cache, "_fingerprints", {})
+    monkeypatch.setattr(cache, "distribution_versions", lambda *names: ["0.0"])
+    assert cache.handler_fingerprint(notebook.notebook) != first
+
+
+def test_notebook_fingerprint_covers_templates(monkeypatch, tmp_path):
+    import jupyter_core.paths
+
+    template = tmp_path / "lab" / "index.html.j2"
+    template.parent.mkdir()
+    template.write_text("{{ body }}")
+    monkeypatch.setattr(jupyter_core.paths, "jupyter_path", lambda *p: [tmp_path])
+    first = notebook.cache_fingerprint()
+    template.write_text("{{ body }} changed")
+    assert notebook.cache_fingerprint() != first
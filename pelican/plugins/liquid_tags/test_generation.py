@@ -1,17 +1,70 @@
 # import filecmp
 import os
-from shutil import rmtree
+import re
+from shutil import copytree, rmtree
+import subprocess
+import sys
 from tempfile import mkdtemp
 import unittest
 
+import nbformat
+
 from pelican import Pelican
 from pelican.settings import read_settings
 
-from .notebook import IPYTHON_VERSION
-
 PLUGIN_DIR = os.path.dirname(__file__)
 TEST_DATA_DIR = os.path.join(PLUGIN_DIR, "test_data")
 
+SITE_CONFIG = """
+AUTHOR = "The Tester"
+SITENAME = "Testing site"
+TIMEZONE = "UTC"
+PATH = "content"
+OUTPUT_PATH = "output"
+CACHE_PATH = "cache"
+READERS = {"html": None}
+FEED_ALL_ATOM = None
+CATEGORY_FEED_ATOM = None
+AUTHOR_FEED_ATOM = None
+AUTHOR_FEED_RSS = None
+PLUGINS = ["liquid_tags"]
+LIQUID_TAGS = ["notebook"]
+NOTEBOOK_DIR = "notebooks"
+NOTEBOOK_HEADER_FILE = "header.html"
+THEME_TEMPLATES_OVERRIDES = ["templates"]
+"""
+
+ARTICLE_TEMPLATE = "{{ article.notebook_header }}{{ article.content }}"
+
+PNG = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kg"
+    "AAAABJRU5ErkJggg=="
+)
+
+# lets the prerendering finish before Pelican cleans the output directory
+SETTLE_PLUGIN = """
+from pelican import signals
+from pelican.plugins.liquid_tags import prefetch
+
+
+def settle(pelican):
+    for future in list(prefetch._results.values()):
+        future.exception()
+
+
+def register():
+    signals.initialized.connect(settle)
+"""
+
+POST = """Title: Post
+Category: tests
+Date: 2015-03-03
+
+{% notebook test_nbformat4.ipynb cells[1:5] %}
+
+{% notebook images.ipynb %}
+"""
+
 
 class TestFullRun(unittest.TestCase):
     """Test running Pelican with the Plugin"""
@@ -28,10 +81,7 @@ class TestFullRun(unittest.TestCase):
         rmtree(self.temp_cache)
         os.chdir(PLUGIN_DIR)
 
-    @unittest.skipIf(
-        IPYTHON_VERSION != 3, reason="output must be created with ipython version 3"
-    )
-    def test_generate_with_ipython3(self):
+    def test_generate_notebooks(self):
         """Test generation of site with the plugin."""
 
         base_path = os.path.dirname(os.path.abspath(__file__))
@@ -45,6 +95,7 @@ class TestFullRun(unittest.TestCase):
                 "PATH": content_path,
                 "OUTPUT_PATH": self.temp_path,
                 "CACHE_PATH": self.temp_cache,
+                "NOTEBOOK_HEADER_FILE": os.path.join(self.temp_cache, "header.html"),
             },
         )
 
@@ -59,44 +110,108 @@ class TestFullRun(unittest.TestCase):
             os.path.join(self.temp_path, "test-ipython-notebook-nb-format-4.html")
         )
 
+        assert os.path.exists(os.path.join(self.temp_cache, "header.html"))
+        assert not os.path.exists(os.path.join(TEST_DATA_DIR, "_nb_header.html"))
+
         # test differences
         # assert filecmp.cmp(os.path.join(output_path,
-        #                                'test-ipython-notebook-v2.html'),
+        #                                'test-ipython-notebook-v3.html'),
         #                   os.path.join(self.temp_path,
         #                                'test-ipython-notebook.html'))
 
-    @unittest.skipIf(
-        IPYTHON_VERSION != 2, reason="output must be created with ipython version 2"
-    )
-    def test_generate_with_ipython2(self):
-        """Test generation of site with the plugin."""
-
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        base_path = os.path.join(base_path, "test_data")
-        content_path = os.path.join(base_path, "content")
-        settings_path = os.path.join(base_path, "pelicanconf.py")
-        settings = read_settings(
-            path=settings_path,
-            override={
-                "PATH": content_path,
-                "OUTPUT_PATH": self.temp_path,
-                "CACHE_PATH": self.temp_cache,
-            },
+    def build_site(self, **settings):
+        """Run Pelican in a new process on a site showing a notebook"""
+        content = os.path.join(self.temp_path, "content")
+        if not os.path.exists(content):
+            copytree(
+                os.path.join(TEST_DATA_DIR, "content", "notebooks"),
+                os.path.join(content, "notebooks"),
+            )
+            nb = nbformat.v4.new_notebook()
+            nb.cells.append(
+                nbformat.v4.new_code_cell(
+                    "plot()",
+                    outputs=[
+                        nbformat.v4.new_output("display_data", data={"image/png": PNG})
+                    ],
+                )
+            )
+            nbformat.write(nb, os.path.join(content, "notebooks", "images.ipynb"))
+            with open(os.path.join(content, "post.md"), "w") as f:
+                f.write(POST)
+            os.mkdir(os.path.join(self.temp_path, "templates"))
+            with open(
+                os.path.join(self.temp_path, "templates", "article.html"), "w"
+            ) as f:
+                f.write(ARTICLE_TEMPLATE)
+        with open(os.path.join(self.temp_path, "pelicanconf.py"), "w") as f:
+            f.write(SITE_CONFIG)
+            for key, value in settings.items():
+                f.write(f"{key} = {value!r}\n")
+        run = subprocess.run(
+            [sys.executable, "-m", "pelican", "-s", "pelicanconf.py"],
+            cwd=self.temp_path,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
         )
-
-        pelican = Pelican(settings)
-        pelican.run()
-
-        # test existence
-        assert os.path.exists(
-            os.path.join(self.temp_path, "test-ipython-notebook-nb-format-3.html")
+        assert run.returncode == 0, run.stdout
+        with open(os.path.join(self.temp_path, "output", "post.html")) as f:
+            return f.read()
+
+    def test_build_from_content_cache(self):
+        """Pooled notebooks are resolved in pages read from Pelican's cache"""
+        settings = dict(
+            NOTEBOOK_PROCESSES=2, CACHE_CONTENT=True, LOAD_CONTENT_CACHE=True
         )
-        assert os.path.exists(
-            os.path.join(self.temp_path, "test-ipython-notebook-nb-format-4.html")
+        first = self.build_site(**settings)
+        assert "jp-Notebook" in first
+        assert "liquid-tags-notebook" not in first
+
+        # nothing is read again, so notebook.py is not imported by a tag
+        rmtree(os.path.join(self.temp_path, "output"))
+        second = self.build_site(**settings)
+        assert second == first
+
+    def test_assets_of_build_from_content_cache(self):
+        """Pages read from Pelican's cache get the notebook files and header"""
+        settings = dict(
+            CACHE_CONTENT=True,
+            LOAD_CONTENT_CACHE=True,
+            LIQUID_TAGS_CACHE=True,
+            NOTEBOOK_IMAGES=True,
+        )
+        first = self.build_site(**settings)
+        rmtree(os.path.join(self.temp_path, "output"))
+        os.remove(os.path.join(self.temp_path, "header.html"))
+        second = self.build_site(**settings)
+
+        assert second == first
+        assert os.path.exists(os.path.join(self.temp_path, "header.html"))
+        files = re.findall(r'"/((?:styles|images)/notebooks/[^"]+)"', second)
+        assert {os.path.dirname(name) for name in files} == {
+            "styles/notebooks",
+            "images/notebooks",
+        }
+        for name in files:
+            assert os.path.exists(os.path.join(self.temp_path, "output", name))
+
+    def test_files_of_prerendered_notebooks(self):
+        """Files written ahead of the build survive the cleaned output"""
+        with open(os.path.join(self.temp_path, "settle.py"), "w") as f:
+            f.write(SETTLE_PLUGIN)
+        settings = dict(
+            PLUGIN_PATHS=["."],
+            PLUGINS=["liquid_tags", "settle"],
+            LIQUID_TAGS_PREFETCH=True,
+            NOTEBOOK_IMAGES=True,
+            DELETE_OUTPUT_DIRECTORY=True,
         )
+        self.build_site(**settings)
+        page = self.build_site(**settings)
 
-        # test differences
-        # assert filecmp.cmp(os.path.join(output_path,
-        #                                'test-ipython-notebook-v3.html'),
-        #                   os.path.join(self.temp_path,
-        #                                'test-ipython-notebook.html'))
+        [image] = re.findall(r'"/(images/notebooks/[^"]+)"', page)
+        assert os.path.exists(os.path.join(self.temp_path, "output", image))
+        assert not os.path.exists(
+            os.path.join(self.temp_path, "cache", "liquid_tags_staging")
+        )
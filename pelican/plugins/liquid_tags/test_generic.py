@@ -40,6 +40,7 @@ class TestFullRun(unittest.TestCase):
                 "PATH": content_path,
                 "OUTPUT_PATH": self.temp_path,
                 "CACHE_PATH": self.temp_cache,
+                "NOTEBOOK_HEADER_FILE": os.path.join(self.temp_cache, "header.html"),
             },
         )
 
@@ -1,3 +1,4 @@
+import os
 import re
 import sys
 import unittest
@@ -284,3 +285,45 @@ class preprocessor:
 )
 def test_create_html(input, expected):
     assert include_code.include_code(preprocessor(), "include_code", input) == expected
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n", "\r"])
+@pytest.mark.parametrize(
+    "first, last", [(1, 1), (2, 4), (3, 9), (9, 20), (20, 30), (5, 2)]
+)
+def test_read_lines_matches_readlines(tmp_path, newline, first, last):
+    path = tmp_path / "code.py"
+    text = newline.join(f"line {i} é " for i in range(10)) + newline + "end"
+    path.write_bytes(text.encode("utf-8"))
+    with open(path, encoding="utf-8") as fh:
+        expected = fh.readlines()[first - 1 : last]
+    assert include_code.read_lines(str(path), first, last) == expected
+
+
+def test_line_index_is_reused_and_scanned_on_demand(tmp_path, monkeypatch):
+    monkeypatch.setattr(include_code, "_CHUNK_SIZE", 64)
+    path = tmp_path / "big.log"
+    path.write_text("".join(f"{i:09d}\r\n" for i in range(1000)))
+
+    assert include_code.read_lines(str(path), 3, 4) == ["000000002\n", "000000003\n"]
+    index = include_code.line_index(str(path), os.stat(path))
+    assert index.scanned < 128
+    assert include_code.read_lines(str(path), 999, 1000) == [
+        "000000998\n",
+        "000000999\n",
+    ]
+    assert include_code.line_index(str(path), os.stat(path)) is index
+    assert index.complete
+
+    with open(path, "a") as fh:
+        fh.write("appended")
+    assert include_code.read_lines(str(path), 1001, 1001) == ["appended"]
+    assert include_code.line_index(str(path), os.stat(path)) is not index
+
+
+@pytest.mark.parametrize("codec", ["utf-16", "utf-8-sig", "iso2022_jp"])
+def test_read_lines_of_other_codecs(tmp_path, codec):
+    path = tmp_path / "code.txt"
+    path.write_text("one\ntwo\nthree\n", encoding=codec)
+    assert not include_code.windowed_codec(codec)
+    assert include_code.read_lines(str(path), 2, 3, codec) == ["two\n", "three\n"]
@@ -0,0 +1,233 @@
+import asyncio
+import pickle
+import sys
+import time
+import unittest
+
+import markdown
+import pytest
+
+from . import mdx_liquid_tags
+from .mdx_liquid_tags import (
+    LiquidTags,
+    _LiquidTagsPreprocessor,
+    add_dependency,
+    to_thread,
+)
+
+if "nosetests" in sys.argv[0]:
+    raise unittest.SkipTest("Those tests are pytest-compatible only")
+
+
+@pytest.fixture
+def preprocessor():
+    @LiquidTags.register("echo")
+    def echo(preprocessor, tag, markup):
+        return f"<{tag}:{markup}>"
+
+    @LiquidTags.register("multiline")
+    def multiline(preprocessor, tag, markup):
+        return "first\nsecond"
+
+    md = markdown.Markdown(extensions=[LiquidTags({})])
+    yield md.preprocessors["mdincludes"]
+
+    del _LiquidTagsPreprocessor._tags["echo"]
+    del _LiquidTagsPreprocessor._tags["multiline"]
+
+
+@pytest.mark.parametrize(
+    "lines,expected",
+    [
+        ([], []),
+        (["no tags", "at all"], ["no tags", "at all"]),
+        (["{% echo a b %}"], ["<echo:a b>"]),
+        (["x {% echo a %} y {% echo b %} z"], ["x <echo:a> y <echo:b> z"]),
+        (
+            ["before", "{% echo", "spans lines %}", "after"],
+            ["before", "<echo:spans lines>", "after"],
+        ),
+        (["a {% multiline %} b"], ["a first", "second b"]),
+        (["{% unknown tag %}"], ["{% unknown tag %}"]),
+        (["{%%} and {%   %}"], ["{%%} and {%   %}"]),
+        (["{% echo a %}", "", "{% echo b"], ["<echo:a>", "", "{% echo b"]),
+        (["trailing", ""], ["trailing", ""]),
+    ],
+)
+def test_run(preprocessor, lines, expected):
+    assert preprocessor.run(lines) == expected
+
+
+def test_run_without_tags_returns_same_list(preprocessor):
+    lines = ["plain", "markdown"]
+    assert preprocessor.run(lines) is lines
+
+
+def test_unterminated_tag_is_reported(preprocessor, caplog):
+    lines = ["{% echo a %}", "text {% echo b", "{% echo c"]
+    assert preprocessor.run(lines) == ["<echo:a>", "text {% echo b", "{% echo c"]
+    assert "at line 2, column 6" in caplog.text
+
+
+def test_stray_delimiters_scan_in_linear_time(preprocessor):
+    # a backtracking scan needs on the order of 10**10 steps for this page
+    lines = ["{{ value }} {% if"] * 200000
+    assert preprocessor.run(lines) == lines
+
+
+class TestRenderCache:
+    @pytest.fixture(autouse=True)
+    def counting_tag(self, tmp_path):
+        self.calls = []
+        self.source = tmp_path / "source.txt"
+        self.source.write_text("one")
+
+        @LiquidTags.register("counted")
+        def counted(preprocessor, tag, markup):
+            self.calls.append(markup)
+            add_dependency(str(self.source))
+            stored = preprocessor.configs.htmlStash.store(self.source.read_text())
+            return f"[{stored}]"
+
+        yield
+        del _LiquidTagsPreprocessor._tags["counted"]
+
+    def convert(self, text, tmp_path):
+        md = markdown.Markdown(
+            extensions=[
+                LiquidTags(
+                    {"LIQUID_TAGS_CACHE": True, "CACHE_PATH": str(tmp_path / "cache")}
+                )
+            ]
+        )
+        return md.convert(text)
+
+    def test_cached_output_is_reused(self, tmp_path):
+        text = "{% counted a %}\n\n{% counted b %}"
+        first = self.convert(text, tmp_path)
+        assert first == "<p>[one]</p>\n<p>[one]</p>"
+        assert self.convert(text, tmp_path) == first
+        assert self.calls == ["a", "b"]
+
+    def test_changed_dependency_is_rendered_again(self, tmp_path):
+        self.convert("{% counted a %}", tmp_path)
+        self.source.write_text("three")
+        assert self.convert("{% counted a %}", tmp_path) == "<p>[three]</p>"
+        assert self.calls == ["a", "a"]
+
+
+def test_threaded_rendering_matches_serial_output():
+    @LiquidTags.register("slow")
+    def slow(preprocessor, tag, markup):
+        # finish in reverse order of submission
+        time.sleep(0.01 * (10 - int(markup)))
+        return preprocessor.configs.htmlStash.store(f"<b>{markup}</b>")
+
+    text = "\n\n".join("{%% slow %d %%} {%% echo %d %%}" % (i, i) for i in range(10))
+    try:
+        serial = markdown.Markdown(extensions=[LiquidTags({})])
+        threaded = markdown.Markdown(
+            extensions=[LiquidTags({"LIQUID_TAGS_THREADS": 4})]
+        )
+        assert threaded.convert(text) == serial.convert(text)
+        assert threaded.htmlStash.rawHtmlBlocks == serial.htmlStash.rawHtmlBlocks
+    finally:
+        del _LiquidTagsPreprocessor._tags["slow"]
+
+
+def test_threads_share_the_stats_of_the_extension(preprocessor, monkeypatch):
+    created = []
+
+    class SlowStats(mdx_liquid_tags.stats.TagStats):
+        def __init__(self, *args):
+            created.append(self)
+            time.sleep(0.05)
+            super().__init__(*args)
+
+    monkeypatch.setattr(mdx_liquid_tags.stats, "TagStats", SlowStats)
+    text = "\n\n".join("{%% echo %d %%}" % i for i in range(8))
+    md = markdown.Markdown(
+        extensions=[LiquidTags({"LIQUID_TAGS_THREADS": 4, "LIQUID_TAGS_STATS": True})]
+    )
+    md.convert(text)
+
+    [tag_stats] = created
+    assert tag_stats.report()["tags"]["echo"]["count"] == 8
+
+
+def test_extension_is_picklable(tmp_path):
+    extension = LiquidTags(
+        {
+            "LIQUID_TAGS_CACHE": True,
+            "LIQUID_TAGS_STATS": True,
+            "LIQUID_TAGS_THREADS": 2,
+            "CACHE_PATH": str(tmp_path),
+        }
+    )
+    extension.tag_cache()
+    extension.tag_stats()
+    extension.thread_pool()
+
+    copy = pickle.loads(pickle.dumps(extension))
+    assert copy.getConfigs() == extension.getConfigs()
+    assert copy.tag_stats() is not extension.tag_stats()
+    extension.thread_pool().shutdown()
+
+
+def test_async_handlers_are_awaited_concurrently(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("content")
+
+    def read(path):
+        add_dependency(path)
+        with open(path) as fh:
+            return fh.read()
+
+    @LiquidTags.register("wait")
+    async def wait(preprocessor, tag, markup):
+        await asyncio.sleep(0.2 - 0.02 * int(markup))
+        text = await to_thread(read, str(source))
+        return preprocessor.configs.htmlStash.store(f"<i>{markup}:{text}</i>")
+
+    text = "\n\n".join("{%% wait %d %%}" % i for i in range(8))
+    md = markdown.Markdown(extensions=[LiquidTags({})])
+    try:
+        started = time.perf_counter()
+        html = md.convert(text)
+        elapsed = time.perf_counter() - started
+    finally:
+        del _LiquidTagsPreprocessor._tags["wait"]
+
+    assert elapsed < 0.2 * 4
+    assert html == "\n".join("<p><i>%d:content</i></p>" % i for i in range(8))
+
+
+def test_async_handler_errors_are_raised():
+    @LiquidTags.register("fail")
+    async def fail(preprocessor, tag, markup):
+        raise ValueError(markup)
+
+    md = markdown.Markdown(extensions=[LiquidTags({})])
+    try:
+        with pytest.raises(ValueError, match="boom"):
+            md.convert("{% fail boom %}")
+    finally:
+        del _LiquidTagsPreprocessor._tags["fail"]
+
+
+def test_tag_modules_are_imported_on_first_use(monkeypatch):
+    module = f"{mdx_liquid_tags.__package__}.literal"
+    monkeypatch.delitem(sys.modules, module, raising=False)
+    monkeypatch.delitem(_LiquidTagsPreprocessor._tags, "literal", raising=False)
+    monkeypatch.setattr(mdx_liquid_tags, "_lazy_tags", {})
+
+    assert LiquidTags.register_lazy("literal")
+    assert not LiquidTags.register_lazy("not_a_builtin_module")
+
+    md = markdown.Markdown(extensions=[LiquidTags({})])
+    md.convert("{% unknown %} {% img /a.png %}")
+    assert module not in sys.modules
+
+    assert md.convert("{% literal foo %}") == "<p>{% foo %}</p>"
+    assert module in sys.modules
+    assert "literal" in _LiquidTagsPreprocessor._tags
@@ -0,0 +1,709 @@
+import base64
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+from types import SimpleNamespace
+import unittest
+import zlib
+
+import markdown
+from nbconvert.exporters import HTMLExporter
+import nbformat
+import pytest
+
+from . import cache, notebook, prefetch
+from .mdx_liquid_tags import LiquidTags
+
+if "nosetests" in sys.argv[0]:
+    raise unittest.SkipTest("Those tests are pytest-compatible only")
+
+NOTEBOOK_DIR = os.path.join(
+    os.path.dirname(__file__), "test_data", "content", "notebooks"
+)
+
+
+@pytest.fixture
+def render(monkeypatch):
+    def render(markup, **configs):
+        configs.setdefault("NOTEBOOK_DIR", NOTEBOOK_DIR)
+        md = markdown.Markdown(extensions=[LiquidTags(configs)])
+        return md.convert("{%% notebook %s %%}" % markup)
+
+    return render
+
+
+@pytest.fixture
+def built(monkeypatch):
+    monkeypatch.setattr(notebook, "_exporters", {})
+    built = []
+    new_exporter = notebook._new_exporter
+
+    def counting(language):
+        built.append(language)
+        return new_exporter(language)
+
+    monkeypatch.setattr(notebook, "_new_exporter", counting)
+    return built
+
+
+def test_exporters_are_reused_across_slices(render, built):
+    first = render("test_nbformat4.ipynb cells[1:2]")
+    second = render("test_nbformat4.ipynb cells[2:3]")
+    assert render("test_nbformat4.ipynb cells[1:2]") == first
+    assert first != second
+    assert built == [None]
+
+
+def test_exporters_are_kept_per_language(render, built):
+    render("test_nbformat4.ipynb cells[1:2]")
+    render("test_nbformat4.ipynb cells[1:2] language[python]")
+    render("test_nbformat4.ipynb cells[1:2] language[python]")
+    assert built == [None, "python"]
+
+
+def test_borrowed_exporter_is_not_shared(built):
+    with notebook.exporter_for("julia") as outer:
+        with notebook.exporter_for("julia") as inner:
+            assert inner is not outer
+    with notebook.exporter_for("julia") as again:
+        assert again in (outer, inner)
+    assert built == ["julia", "julia"]
+
+
+@pytest.fixture
+def exported(monkeypatch):
+    """Number of notebook cells passed to each export"""
+    exported = []
+    from_notebook_node = HTMLExporter.from_notebook_node
+
+    def counting(self, nb, *args, **kwargs):
+        exported.append(sum(cell.source != notebook._BOUNDARY for cell in nb.cells))
+        return from_notebook_node(self, nb, *args, **kwargs)
+
+    monkeypatch.setattr(HTMLExporter, "from_notebook_node", counting)
+    return exported
+
+
+def test_cell_cache_output_matches_full_export(render, exported, tmp_path):
+    cached = {"LIQUID_TAGS_CACHE": True, "CACHE_PATH": str(tmp_path)}
+    full = render("test_nbformat4.ipynb cells[0:6]")
+    assert render("test_nbformat4.ipynb cells[2:6]", **cached) != full
+    assert render("test_nbformat4.ipynb cells[0:6]", **cached) == full
+    assert exported == [6, 4, 2]
+
+
+def test_changed_cell_is_exported_alone(render, exported, tmp_path):
+    notebooks = tmp_path / "notebooks"
+    notebooks.mkdir()
+    path = notebooks / "nb.ipynb"
+    shutil.copy(os.path.join(NOTEBOOK_DIR, "test_nbformat4.ipynb"), path)
+    cached = {
+        "LIQUID_TAGS_CACHE": True,
+        "CACHE_PATH": str(tmp_path / "cache"),
+        "NOTEBOOK_DIR": str(notebooks),
+    }
+    before = render("nb.ipynb", **cached)
+
+    nb = nbformat.read(str(path), as_version=4)
+    nb.cells[2].source = "Edited cell"
+    nbformat.write(nb, str(path))
+    after = render("nb.ipynb", **cached)
+
+    assert "Edited cell" in after and "Edited cell" not in before
+    assert exported == [len(nb.cells), 1]
+    assert after == render("nb.ipynb", NOTEBOOK_DIR=str(notebooks))
+
+
+def test_slice_cells_does_not_copy_or_modify():
+    nb = nbformat.read(os.path.join(NOTEBOOK_DIR, "test_nbformat4.ipynb"), as_version=4)
+    cells = list(nb.cells)
+    sliced = notebook.slice_cells(nb, 1, 3)
+    assert nb.cells == cells
+    assert len(sliced.cells) == 2
+    assert all(a is b for a, b in zip(sliced.cells, cells[1:3]))
+
+
+@pytest.mark.parametrize("name", ["test_nbformat3.ipynb", "test_nbformat4.ipynb"])
+def test_notebook_is_parsed_once_per_version(render, monkeypatch, tmp_path, name):
+    parsed = []
+    index_notebook = notebook.index_notebook
+
+    def counting(path):
+        parsed.append(path)
+        return index_notebook(path)
+
+    monkeypatch.setattr(notebook, "index_notebook", counting)
+    monkeypatch.setattr(notebook, "notebooks", notebook.NotebookStore(1 << 20))
+    path = tmp_path / "nb.ipynb"
+    shutil.copy(os.path.join(NOTEBOOK_DIR, name), path)
+
+    first = render("nb.ipynb cells[0:2]", NOTEBOOK_DIR=str(tmp_path))
+    render("nb.ipynb cells[2:4]", NOTEBOOK_DIR=str(tmp_path))
+    assert render("nb.ipynb cells[0:2]", NOTEBOOK_DIR=str(tmp_path)) == first
+    assert len(parsed) == 1
+
+    with open(path, "a") as fh:
+        fh.write("\n")
+    render("nb.ipynb cells[0:2]", NOTEBOOK_DIR=str(tmp_path))
+    assert len(parsed) == 2
+
+
+@pytest.mark.parametrize("name", ["test_nbformat3.ipynb", "test_nbformat4.ipynb"])
+@pytest.mark.parametrize("start, end", [(0, None), (1, 3), (-2, None), (5, 2)])
+def test_read_notebook_matches_nbformat(name, start, end):
+    path = os.path.join(NOTEBOOK_DIR, name)
+    with open(path, encoding="utf-8") as fh:
+        expected = nbformat.reads(fh.read(), as_version=4)
+    nb, _ = notebook.read_notebook(path, start, end)
+    for cell in expected.cells + nb.cells:
+        # cells converted from nbformat 3 get random ids
+        cell.pop("id", None)
+    expected.cells = expected.cells[start:end]
+    assert nb == expected
+
+
+def test_read_notebook_decodes_only_selected_cells(monkeypatch, tmp_path):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_raw_cell(f'cell {i} "quoted" \\ [{{') for i in range(20)
+    ]
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(nb, path)
+
+    decoded = []
+    loads = notebook.json.loads
+
+    def counting(data, *args, **kwargs):
+        value = loads(data, *args, **kwargs)
+        if isinstance(value, dict) and "cell_type" in value:
+            decoded.append(value)
+        return value
+
+    monkeypatch.setattr(notebook.json, "loads", counting)
+    sliced, size = notebook.read_notebook(path, 10, 12)
+    assert [cell.source for cell in sliced.cells] == [c.source for c in nb.cells[10:12]]
+    assert len(decoded) == 2
+    assert size < os.path.getsize(path) / 5
+
+
+@pytest.fixture
+def tagged_notebook(tmp_path):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell(f"x = {i}") for i in range(12)]
+    for i, cell in enumerate(nb.cells):
+        cell.id = f"cell-{i}"
+        if i % 4 == 1:
+            cell.metadata.tags = ["figure"]
+        elif i == 6:
+            cell.metadata.tags = ["table", "hide"]
+        elif i == 7:
+            cell.source = "# figure"
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(nb, path)
+    return path
+
+
+@pytest.mark.parametrize(
+    "selection, expected",
+    [
+        ("tag:figure", [1, 5, 9]),
+        ("tag: table, figure", [1, 5, 6, 9]),
+        ("id:cell-3,cell-0", [0, 3]),
+        ("9, 1, 5, 1", [1, 5, 9]),
+        ("-1,0", [0, 11]),
+        ("tag:missing", []),
+    ],
+)
+def test_read_notebook_selects_cells(tagged_notebook, monkeypatch, selection, expected):
+    decoded = []
+    loads = notebook.json.loads
+
+    def counting(data, *args, **kwargs):
+        value = loads(data, *args, **kwargs)
+        if isinstance(value, dict) and "cell_type" in value:
+            decoded.append(value)
+        return value
+
+    monkeypatch.setattr(notebook.json, "loads", counting)
+    nb, _ = notebook.read_notebook(tagged_notebook, selection=selection)
+    assert [cell.id for cell in nb.cells] == [f"cell-{i}" for i in expected]
+    if selection.startswith("tag:figure"):
+        # cells whose JSON lacks the tag are not decoded
+        assert len(decoded) == 4
+
+
+@pytest.mark.parametrize("selection", ["12", "-13", "1,a", "name:x", "tag:"])
+def test_invalid_cell_selection(tagged_notebook, selection):
+    with pytest.raises(ValueError):
+        notebook.read_notebook(tagged_notebook, selection=selection)
+
+
+def test_selected_cells_are_rendered(render, tagged_notebook):
+    nb_dir = os.path.dirname(tagged_notebook)
+    body = render("nb.ipynb cells[tag:figure]", NOTEBOOK_DIR=nb_dir)
+    assert render("nb.ipynb cells[1,5,9]", NOTEBOOK_DIR=nb_dir) == body
+    numbers = re.findall(r'<span class="mi">(\d+)</span>', body)
+    assert numbers == ["1", "5", "9"]
+
+
+def test_notebook_store_evicts_least_recently_used(tmp_path):
+    source = os.path.join(NOTEBOOK_DIR, "test_nbformat4.ipynb")
+    paths = [str(tmp_path / f"{name}.ipynb") for name in "abc"]
+    for path in paths:
+        shutil.copy(source, path)
+    store = notebook.NotebookStore(2 * notebook.index_notebook(source).size)
+
+    a = store.index(paths[0])
+    store.get(paths[1], 0, 2)
+    assert store.index(paths[0]) is a
+    store.get(paths[2], 1, 3)
+    assert store.index(paths[0]) is a
+    assert list(store._entries) == [paths[2], paths[0]]
+
+
+def test_index_of_changed_file_is_not_read(tmp_path):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_raw_cell("old")]
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(nb, path)
+    store = notebook.NotebookStore(1 << 20)
+    index = store.index(path)
+
+    nb.cells[0].source = "new, and longer"
+    nbformat.write(nb, path)
+    with pytest.raises(notebook.FileChangedError):
+        index.read()
+    assert store.get(path).cells[0].source == "new, and longer"
+
+
+def test_store_size_setting_is_applied_per_conversion(render, monkeypatch):
+    store = notebook.NotebookStore(1 << 30)
+    monkeypatch.setattr(notebook, "notebooks", store)
+    render("test_nbformat4.ipynb cells[0:2]", NOTEBOOK_STORE_MAX_SIZE=0)
+    assert store.max_size == 1 << 30
+    assert not store._entries
+    render("test_nbformat4.ipynb cells[0:2]")
+    assert len(store._entries) == 1
+
+
+def test_pooled_conversion_is_resolved_after_reading(render):
+    inline = render("test_nbformat4.ipynb cells[0:4]")
+    pooled = render("test_nbformat4.ipynb cells[0:4]", NOTEBOOK_PROCESSES=2)
+    assert pooled != inline
+
+    article = SimpleNamespace(_content=pooled)
+    # as restored from Pelican's content cache, with no conversion under way
+    cached = SimpleNamespace(_content=pooled)
+    generator = SimpleNamespace(articles=[article], settings={})
+    notebook.resolve_conversions([generator])
+    notebook.resolve_conversions([SimpleNamespace(pages=[cached], settings={})])
+
+    assert article._content == inline
+    assert cached._content == inline
+    assert notebook._pool is None
+
+
+def test_pooled_conversion_is_resolved_within_text():
+    def convert(**configs):
+        configs["NOTEBOOK_DIR"] = NOTEBOOK_DIR
+        md = markdown.Markdown(extensions=[LiquidTags(configs)])
+        return md.convert(
+            "before\n\n{% notebook test_nbformat4.ipynb cells[0:2] %}\n\nafter"
+        )
+
+    inline = convert()
+    article = SimpleNamespace(_content=convert(NOTEBOOK_PROCESSES=2))
+    notebook.resolve_conversions([SimpleNamespace(articles=[article], settings={})])
+    assert article._content == inline
+    assert inline.endswith("<p>after</p>")
+
+
+def test_import_does_not_load_ipython_or_nbconvert():
+    code = (
+        "import sys, pelican.plugins.liquid_tags.notebook; "
+        "print(sorted({'IPython', 'nbconvert', 'nbformat'} & set(sys.modules)))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    assert output.strip() == "[]"
+
+
+def test_highlighted_sources_are_memoized(monkeypatch):
+    from nbconvert.filters import highlight
+
+    monkeypatch.setattr(notebook, "highlights", notebook.HighlightCache(2))
+    calls = []
+    pygments_highlight = highlight._pygments_highlight
+
+    def counting(source, formatter, language):
+        calls.append((source, formatter, language))
+        return pygments_highlight(source, formatter, language)
+
+    monkeypatch.setattr(highlight, "_pygments_highlight", counting)
+
+    first = notebook.custom_highlighter("x = 1")
+    assert notebook.custom_highlighter("x = 1") == first
+    assert '<pre class="ipynb">' in first
+    notebook.custom_highlighter("x = 1", language="julia")
+    notebook.custom_highlighter("y = 2")
+    notebook.custom_highlighter("x = 1")
+    assert [language for _, _, language in calls] == [
+        "ipython",
+        "julia",
+        "ipython",
+        "ipython",
+    ]
+    assert calls[0][1] is calls[1][1]
+
+
+def test_highlight_cache_persists(tmp_path):
+    path = str(tmp_path / "cache" / notebook.HIGHLIGHT_FILE)
+    saved = notebook.HighlightCache(10)
+    saved.save(path)
+    assert not os.path.exists(path)
+    saved.set("a", "<a>")
+    saved.set("b", "<b>")
+    saved.save(path)
+
+    loaded = notebook.HighlightCache(2)
+    loaded.set("c", "<c>")
+    loaded.load(path)
+    assert list(loaded._entries) == ["b", "c"]
+    assert loaded.get("b") == "<b>"
+
+
+def png(width, height):
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    pixels = zlib.compress(b"".join(b"\0" + b"\0" * width for _ in range(height)))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", pixels)
+        + chunk(b"IEND", b"")
+    )
+
+
+@pytest.fixture
+def image_notebook(tmp_path):
+    image = base64.b64encode(png(3, 2)).decode("ascii")
+    nb = nbformat.v4.new_notebook()
+    for _ in range(2):
+        nb.cells.append(
+            nbformat.v4.new_code_cell(
+                "plot()",
+                outputs=[
+                    nbformat.v4.new_output(
+                        "display_data",
+                        data={"image/png": image, "text/plain": "<Figure>"},
+                    )
+                ],
+            )
+        )
+    nb.cells.append(
+        nbformat.v4.new_code_cell(
+            "svg()",
+            outputs=[
+                nbformat.v4.new_output(
+                    "display_data", data={"image/svg+xml": "<svg></svg>"}
+                )
+            ],
+        )
+    )
+    notebooks = tmp_path / "notebooks"
+    notebooks.mkdir()
+    nbformat.write(nb, str(notebooks / "images.ipynb"))
+    return notebooks
+
+
+def test_output_images_are_written_once(render, image_notebook, tmp_path):
+    output = tmp_path / "output"
+    body = render(
+        "images.ipynb",
+        NOTEBOOK_DIR=str(image_notebook),
+        NOTEBOOK_IMAGES=True,
+        OUTPUT_PATH=str(output),
+        SITEURL="https://example.com",
+    )
+    files = sorted(os.listdir(output / "images" / "notebooks"))
+    assert [os.path.splitext(name)[1] for name in files] == [".png", ".svg"]
+    assert (output / "images" / "notebooks" / files[0]).read_bytes() == png(3, 2)
+
+    url = "https://example.com/images/notebooks/" + files[0]
+    assert body.count('<img loading="lazy" ') == 3
+    assert body.count(f'height="2" src="{url}" width="3"') == 2
+    assert 'src="data:' not in body
+    assert "/images/notebooks/" + files[1] in body
+
+
+def test_image_size():
+    assert notebook.image_size(png(640, 480)) == (640, 480)
+    jpeg = (
+        b"\xff\xd8"
+        + b"\xff\xe0\x00\x04\x00\x00"
+        + b"\xff\xc0\x00\x11\x08\x01\xe0\x02\x80"
+    )
+    assert notebook.image_size(jpeg) == (640, 480)
+    assert notebook.image_size(b"GIF89a") is None
+
+
+def test_images_of_cached_tags_are_restored(render, image_notebook, tmp_path):
+    settings = dict(
+        NOTEBOOK_DIR=str(image_notebook),
+        NOTEBOOK_IMAGES=True,
+        OUTPUT_PATH=str(tmp_path / "output"),
+        CACHE_PATH=str(tmp_path / "cache"),
+        LIQUID_TAGS_CACHE=True,
+    )
+    body = render("images.ipynb", **settings)
+    shutil.rmtree(tmp_path / "output")
+    assert render("images.ipynb", **settings) == body
+
+    article = SimpleNamespace(_content=body)
+    generator = SimpleNamespace(
+        articles=[article],
+        settings=dict(settings, NOTEBOOK_IMAGES_DIR="images/notebooks"),
+    )
+    notebook.restore_files([generator])
+    assert len(os.listdir(tmp_path / "output" / "images" / "notebooks")) == 2
+
+
+def test_undisplayed_outputs_are_pruned():
+    view = {"model_id": "1", "version_major": 2, "version_minor": 0}
+    nb = nbformat.v4.new_notebook(
+        metadata={"widgets": {"application/vnd.jupyter.widget-state+json": {}}},
+        cells=[
+            nbformat.v4.new_markdown_cell("text"),
+            nbformat.v4.new_code_cell(
+                "slider",
+                outputs=[
+                    nbformat.v4.new_output(
+                        "display_data",
+                        data={
+                            "application/vnd.jupyter.widget-view+json": view,
+                            "text/plain": "IntSlider(value=0)",
+                        },
+                    ),
+                    nbformat.v4.new_output(
+                        "display_data", data={"application/vnd.custom+json": {}}
+                    ),
+                ],
+            ),
+        ],
+    )
+    pruned = notebook.prune_outputs(nb)
+    assert "widgets" not in pruned.metadata and "widgets" in nb.metadata
+    assert pruned.cells[0] is nb.cells[0]
+    [output] = pruned.cells[1].outputs
+    assert output.data == {"text/plain": "IntSlider(value=0)"}
+    assert len(nb.cells[1].outputs) == 2
+
+
+@pytest.fixture
+def long_output_notebook(tmp_path):
+    lines = "".join(f"line {i:04d}\n" for i in range(1000))
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell(
+            "print_lines()",
+            outputs=[nbformat.v4.new_output("stream", name="stdout", text=lines)],
+        ),
+        nbformat.v4.new_code_cell(
+            "lines",
+            outputs=[
+                nbformat.v4.new_output(
+                    "execute_result", data={"text/plain": lines}, execution_count=1
+                )
+            ],
+        ),
+    ]
+    notebooks = tmp_path / "notebooks"
+    notebooks.mkdir()
+    nbformat.write(nb, str(notebooks / "long.ipynb"))
+    return notebooks, lines
+
+
+def test_long_outputs_are_cut(render, long_output_notebook, tmp_path):
+    notebooks, lines = long_output_notebook
+    output = tmp_path / "output"
+    body = render(
+        "long.ipynb",
+        NOTEBOOK_DIR=str(notebooks),
+        NOTEBOOK_CELL_OUTPUT_MAX_SIZE=100,
+        OUTPUT_PATH=str(output),
+    )
+    [name] = os.listdir(output / "outputs" / "notebooks")
+    assert (output / "outputs" / "notebooks" / name).read_text() == lines
+    assert body.count(f'<a href="/outputs/notebooks/{name}">') == 2
+    assert body.count("Output truncated to 10 of 1000 lines.") == 2
+    assert "line 0009" in body and "line 0010" not in body
+
+
+def test_notebook_output_budget_is_shared(render, long_output_notebook, tmp_path):
+    notebooks, lines = long_output_notebook
+    body = render(
+        "long.ipynb",
+        NOTEBOOK_DIR=str(notebooks),
+        NOTEBOOK_OUTPUT_MAX_SIZE=len(lines) + 50,
+        OUTPUT_PATH=str(tmp_path / "output"),
+    )
+    assert "line 0999" in body
+    assert "Output truncated to 5 of 1000 lines." in body
+
+
+def test_notebooks_are_prerendered_at_initialization(render, monkeypatch, tmp_path):
+    converted = []
+    convert = notebook.convert
+
+    def counting(nb_path, start, end, *args):
+        converted.append((threading.current_thread().name, start, end))
+        return convert(nb_path, start, end, *args)
+
+    monkeypatch.setattr(notebook, "convert", counting)
+    (tmp_path / "post.md").write_text(
+        "{% notebook test_nbformat4.ipynb cells[0:3] %}\n"
+        "{% notebook missing.ipynb %}\n"
+    )
+    inline = render("test_nbformat4.ipynb cells[0:3]")
+    configs = {"NOTEBOOK_DIR": NOTEBOOK_DIR, "LIQUID_TAGS_PREFETCH": True}
+    prefetch.start(LiquidTags(configs), str(tmp_path))
+    try:
+        assert render("test_nbformat4.ipynb cells[0:3]", **configs) == inline
+    finally:
+        prefetch.clear()
+    assert [(start, end) for _, start, end in converted] == [(0, 3), (0, 3)]
+    assert converted[1][0].startswith("liquid-tags-prefetch")
+
+
+@pytest.fixture
+def prefetched_post(tmp_path, monkeypatch):
+    monkeypatch.setattr(notebook, "_worker_caches", {})
+    content = tmp_path / "content"
+    content.mkdir()
+    (content / "post.md").write_text("{% notebook test_nbformat4.ipynb cells[0:3] %}")
+    configs = {
+        "NOTEBOOK_DIR": NOTEBOOK_DIR,
+        "LIQUID_TAGS_PREFETCH": True,
+        "LIQUID_TAGS_CACHE": True,
+        "CACHE_PATH": str(tmp_path / "cache"),
+    }
+
+    def build(**overrides):
+        extension = LiquidTags(dict(configs, **overrides))
+        prefetch.start(extension, str(content))
+        try:
+            md = markdown.Markdown(extensions=[extension])
+            return md.convert("{% notebook test_nbformat4.ipynb cells[0:3] %}")
+        finally:
+            prefetch.clear()
+
+    return build
+
+
+def prerenders():
+    return [args for func, args in prefetch._results if func is notebook.prerender]
+
+
+def test_prerendering_shares_the_render_cache(prefetched_post, monkeypatch):
+    created = []
+    tag_cache = cache.TagCache
+
+    def counting(*args):
+        created.append(args)
+        return tag_cache(*args)
+
+    monkeypatch.setattr(cache, "TagCache", counting)
+    prefetched_post()
+    assert len(created) == 1
+
+
+def test_cached_notebooks_are_not_prerendered(prefetched_post, monkeypatch):
+    first = prefetched_post()
+    jobs = []
+    convert_job = notebook._convert_job
+
+    def counting(payload):
+        jobs.append(payload)
+        return convert_job(payload)
+
+    monkeypatch.setattr(notebook, "_convert_job", counting)
+    monkeypatch.setattr(prefetch, "clear", lambda: None)
+    try:
+        assert prefetched_post() == first
+        assert not prerenders()
+    finally:
+        prefetch._results.clear()
+    assert not jobs
+
+
+def test_prerendering_uses_the_process_pool(prefetched_post, monkeypatch):
+    monkeypatch.setattr(prefetch, "clear", lambda: None)
+    try:
+        prefetched_post(NOTEBOOK_PROCESSES=1, LIQUID_TAGS_CACHE=False)
+        assert not prerenders()
+        assert len(notebook._conversions) == 1
+    finally:
+        prefetch._results.clear()
+        notebook.shutdown()
+
+
+def test_minify_css_drops_comments_spaces_and_repeated_rules():
+    css = """
+    /* comment */
+    pre { color: red; }
+    a > b, c { margin: 0 ; }
+    pre { color: red; }
+    @media print { pre { color: black; } }
+    """
+    assert notebook.minify_css(css) == (
+        "a>b,c{margin:0}pre{color:red}@media print{pre{color:black}}"
+    )
+
+
+def test_header_links_to_content_addressed_styles(monkeypatch, tmp_path, capsys):
+    monkeypatch.chdir(tmp_path)
+    settings = {"OUTPUT_PATH": str(tmp_path / "output"), "SITEURL": "/blog"}
+    generators = [SimpleNamespace(settings=settings)]
+    notebook.write_header(generators)
+
+    [name] = os.listdir(tmp_path / "output" / "styles" / "notebooks")
+    styles = (tmp_path / "output" / "styles" / "notebooks" / name).read_text()
+    assert styles == notebook.notebook_styles()
+    assert ".highlight .k{" in styles and "\n" not in styles
+    header = (tmp_path / notebook.HEADER_FILE).read_text()
+    assert f'<link rel="stylesheet" href="/blog/styles/notebooks/{name}">' in header
+    assert "<style" not in header
+    assert "Writing styles" in capsys.readouterr().out
+
+    notebook.write_header(generators)
+    assert capsys.readouterr().out == ""
+
+
+def test_pages_get_the_assets_they_use(render, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    shown = SimpleNamespace(_content=render("test_nbformat4.ipynb cells[0:2]"))
+    pooled = SimpleNamespace(_content="<!--liquid-tags-notebook:00-->")
+    math = SimpleNamespace(_content=r"<p>Euler: \(e^{i\pi} = -1\)</p>")
+    rendered = SimpleNamespace(_content='<span class="math">x^2</span>')
+    plain = SimpleNamespace(_content="<p>It costs 5 $.</p>")
+    prices = SimpleNamespace(_content="<p>From $5 to $10, or $$$.</p>")
+    generator = SimpleNamespace(
+        settings={"OUTPUT_PATH": str(tmp_path)},
+        articles=[shown, math, rendered, plain, prices],
+        pages=[pooled],
+    )
+    notebook.write_header([generator])
+
+    header = (tmp_path / notebook.HEADER_FILE).read_text()
+    assert shown.notebook_header == pooled.notebook_header == header
+    assert math.notebook_header == rendered.notebook_header
+    assert math.notebook_header == notebook.MATHJAX_INCLUDE
+    assert not hasattr(plain, "notebook_header")
+    assert not hasattr(prices, "notebook_header")
+    assert "jquery" not in header.lower()
@@ -0,0 +1,101 @@
+import sys
+import threading
+import unittest
+
+import pytest
+
+from . import prefetch
+
+if "nosetests" in sys.argv[0]:
+    raise unittest.SkipTest("Those tests are pytest-compatible only")
+
+
+class Configs:
+    def getConfig(self, key):
+        return {"LIQUID_TAGS_PREFETCH_WORKERS": 4}[key]
+
+
+@pytest.fixture
+def fetched():
+    calls = []
+    lock = threading.Lock()
+
+    @prefetch.remote
+    def fetch(resource):
+        with lock:
+            calls.append((threading.current_thread().name, resource))
+        return resource.upper()
+
+    @prefetch.prefetcher("fetch")
+    def prefetch_fetch(configs, markup):
+        if markup == "broken":
+            raise ValueError(markup)
+        yield fetch, (markup,)
+
+    yield fetch, calls
+
+    del prefetch._prefetchers["fetch"]
+    prefetch.clear()
+
+
+def test_prefetched_results_are_served_from_memory(tmp_path, fetched):
+    fetch, calls = fetched
+    (tmp_path / "a.md").write_text("{% fetch one %} {% fetch two %}")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.markdown").write_text("{% fetch one %}\n{% fetch broken %}")
+    (tmp_path / "c.rst").write_text("{% fetch three %}")
+    (tmp_path / "output").mkdir()
+    (tmp_path / "output" / "d.md").write_text("{% fetch four %}")
+
+    prefetch.start(Configs(), str(tmp_path), exclude=[str(tmp_path / "output")])
+
+    assert fetch("one") == "ONE"
+    assert fetch("two") == "TWO"
+    assert fetch("three") == "THREE"
+    assert sorted(resource for _, resource in calls) == ["one", "three", "two"]
+    assert all(
+        name.startswith("liquid-tags-prefetch")
+        for name, resource in calls
+        if resource != "three"
+    )
+
+
+def test_clear_drops_prefetched_results(tmp_path, fetched):
+    fetch, calls = fetched
+    (tmp_path / "a.md").write_text("{% fetch one %}")
+    prefetch.start(Configs(), str(tmp_path))
+    fetch("one")
+    prefetch.clear()
+    fetch("one")
+    assert len(calls) == 2
+
+
+def test_only_sources_pelican_reads_are_scanned(tmp_path):
+    for name in [
+        "a.md",
+        "pages/b.md",
+        "drafts/c.md",
+        "images/d.md",
+        "e.md~",
+        ".#f.md",
+        "tmp/g.md",
+        "output/h.md",
+        "cache/i.md",
+    ]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text("{% fetch %}")
+    settings = {
+        "PATH": str(tmp_path),
+        "OUTPUT_PATH": str(tmp_path / "output"),
+        "CACHE_PATH": str(tmp_path / "cache"),
+        "ARTICLE_PATHS": [""],
+        "ARTICLE_EXCLUDES": ["pages", "drafts", "images"],
+        "PAGE_PATHS": ["pages"],
+        "PAGE_EXCLUDES": [""],
+        "IGNORE_FILES": [".#*", "tmp"],
+    }
+
+    assert prefetch.content_sources(settings) == [
+        str(tmp_path / "a.md"),
+        str(tmp_path / "pages" / "b.md"),
+    ]
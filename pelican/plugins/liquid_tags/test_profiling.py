@@ -0,0 +1,90 @@
+import os
+import pstats
+import sys
+from types import SimpleNamespace
+import unittest
+
+import markdown
+
+from .liquid_tags import addLiquidTags
+from .mdx_liquid_tags import LiquidTags, _LiquidTagsPreprocessor, current_source
+from .profiling import PROFILE_DIR, TagProfiler
+
+if "nosetests" in sys.argv[0]:
+    raise unittest.SkipTest("Those tests are pytest-compatible only")
+
+
+def test_filters(tmp_path):
+    profiler = TagProfiler(str(tmp_path), ["notebook"], ["*/posts/*.md"])
+    assert profiler.wants("notebook", "content/posts/big.md")
+    assert not profiler.wants("notebook", "content/pages/big.md")
+    assert not profiler.wants("notebook", None)
+    assert not profiler.wants("img", "content/posts/big.md")
+    assert TagProfiler(str(tmp_path)).wants("img", None)
+    assert profiler.filename("notebook", "content/posts/big.md", 3) == os.path.join(
+        str(tmp_path), "posts", "big-003-notebook.pstats"
+    )
+
+
+def test_profiles_of_equal_names_are_kept_apart(tmp_path):
+    profiler = TagProfiler(str(tmp_path), "notebook", root="content")
+    assert profiler.tags == {"notebook"}
+    names = {
+        profiler.filename("notebook", source, 1)
+        for source in ["content/a/post.md", "content/b/post.md", "/x/post.md"]
+    }
+    names.add(profiler.filename("notebook", "/y/post.md", 1))
+    assert len(names) == 4
+
+
+def test_matching_tags_are_profiled(tmp_path):
+    def busy():
+        return sum(range(1000))
+
+    @LiquidTags.register("heavy")
+    def heavy(preprocessor, tag, markup):
+        return str(busy())
+
+    @LiquidTags.register("light")
+    def light(preprocessor, tag, markup):
+        return markup
+
+    extension = LiquidTags(
+        {
+            "LIQUID_TAGS_PROFILE": ["heavy"],
+            "CACHE_PATH": str(tmp_path),
+        }
+    )
+    extension.content_path = "content"
+    md = markdown.Markdown(extensions=[extension])
+    token = current_source.set("content/post.md")
+    try:
+        md.convert("{% light a %} {% heavy %}\n\n{% heavy %}")
+    finally:
+        current_source.reset(token)
+        del _LiquidTagsPreprocessor._tags["heavy"]
+        del _LiquidTagsPreprocessor._tags["light"]
+
+    directory = tmp_path / PROFILE_DIR
+    assert sorted(os.listdir(str(directory))) == [
+        "post-002-heavy.pstats",
+        "post-003-heavy.pstats",
+    ]
+    profile = pstats.Stats(str(directory / "post-002-heavy.pstats"))
+    assert any(name == "busy" for _, _, name in profile.stats)
+
+
+def test_profiles_are_named_within_pelican_content_path(tmp_path):
+    settings = {
+        "MARKDOWN": {"extensions": []},
+        "PATH": str(tmp_path / "site"),
+        "CACHE_PATH": str(tmp_path),
+        "LIQUID_TAGS_PROFILE": "notebook",
+    }
+    addLiquidTags(SimpleNamespace(settings=settings))
+    [extension] = settings["MARKDOWN"]["extensions"]
+
+    profiler = extension.tag_profiler()
+    assert profiler.filename(
+        "notebook", str(tmp_path / "site" / "posts" / "a.md"), 1
+    ) == os.path.join(str(tmp_path), PROFILE_DIR, "posts", "a-001-notebook.pstats")
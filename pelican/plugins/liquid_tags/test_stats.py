@@ -0,0 +1,99 @@
+import json
+import logging
+import sys
+import unittest
+
+import markdown
+
+from . import mdx_liquid_tags
+from .mdx_liquid_tags import LiquidTags, _LiquidTagsPreprocessor, current_source
+from .stats import TagStats, percentile
+
+if "nosetests" in sys.argv[0]:
+    raise unittest.SkipTest("Those tests are pytest-compatible only")
+
+
+def test_percentile():
+    assert percentile([3.0], 0.95) == 3.0
+    assert percentile(list(range(1, 101)), 0.95) == 95
+    assert percentile([5, 1, 4, 2, 3], 0.5) == 3
+
+
+def test_report_and_table(tmp_path):
+    tag_stats = TagStats()
+    tag_stats.record("img", "a.md", "/a.png", 0.001, 10)
+    tag_stats.record("img", "b.md", "/b.png", 0.003, 20, cached=True)
+    tag_stats.record("notebook", "a.md", "nb.ipynb", 1.5, 5000, cached=False)
+
+    report = tag_stats.report()
+    assert report["tags"]["img"]["count"] == 2
+    assert report["tags"]["img"]["bytes"] == 30
+    assert report["tags"]["img"]["p95"] == 0.003
+    assert report["tags"]["notebook"]["cache_misses"] == 1
+    assert [(s["tag"], s["source"]) for s in report["sources"]] == [
+        ("img", "a.md"),
+        ("img", "b.md"),
+        ("notebook", "a.md"),
+    ]
+
+    table = tag_stats.format_table().splitlines()
+    assert table[0].split() == ["tag", "calls", "total", "s", "p95", "ms"] + [
+        "bytes",
+        "hits",
+        "misses",
+    ]
+    assert table[2].startswith("notebook")
+
+    path = tmp_path / "stats.json"
+    tag_stats.write_json(str(path))
+    assert json.loads(path.read_text()) == report
+
+
+def test_slow_tags_are_logged(caplog):
+    tag_stats = TagStats(slow_threshold=1)
+    tag_stats.record("fast", "a.md", "x", 0.5, 1)
+    tag_stats.record("slow", "a.md", "x y", 2.5, 1)
+    assert "fast" not in caplog.text
+    assert "Slow liquid tag (2.50s) in a.md: {% slow x y %}" in caplog.text
+
+
+def test_preprocessor_records_tags_per_source():
+    @LiquidTags.register("measured")
+    def measured(preprocessor, tag, markup):
+        return preprocessor.configs.htmlStash.store("<b>%s</b>" % markup)
+
+    extension = LiquidTags({"LIQUID_TAGS_STATS": True})
+    md = markdown.Markdown(extensions=[extension])
+    token = current_source.set("post.md")
+    try:
+        md.convert("{% measured one %} {% measured two %}")
+    finally:
+        current_source.reset(token)
+        del _LiquidTagsPreprocessor._tags["measured"]
+
+    (entry,) = extension.tag_stats().report()["sources"]
+    assert entry["tag"] == "measured"
+    assert entry["source"] == "post.md"
+    assert entry["count"] == 2
+    assert entry["bytes"] == len("<b>one</b><b>two</b>") + 2 * len(
+        "\x02liquid-tags-stash:0\x03"
+    )
+    assert entry["cache_hits"] == entry["cache_misses"] == 0
+
+
+def test_unknown_tags_are_counted(caplog, monkeypatch):
+    monkeypatch.setattr(mdx_liquid_tags, "_unknown_tags", set())
+    caplog.set_level(logging.INFO, logger=mdx_liquid_tags.__name__)
+    extension = LiquidTags({"LIQUID_TAGS_STATS": True})
+    md = markdown.Markdown(extensions=[extension])
+    token = current_source.set("post.md")
+    try:
+        md.convert("{% nosuchtag a %} {% nosuchtag b %}")
+    finally:
+        current_source.reset(token)
+
+    report = extension.tag_stats().report()
+    assert report["tags"] == {}
+    assert report["unknown"] == [{"tag": "nosuchtag", "source": "post.md", "count": 2}]
+    assert "unknown tags: nosuchtag (2)" in extension.tag_stats().format_table()
+    assert caplog.text.count("Unknown liquid tag 'nosuchtag'") == 1
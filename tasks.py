@@ -28,6 +28,15 @@ def tests(c):
     c.run(f"{CMD_PREFIX}pytest", pty=PTY)
 
 
+@task
+def benchmark(c, articles=100, tags=10):
+    """Run the synthetic-corpus throughput benchmark."""
+    c.run(
+        f"{CMD_PREFIX}python benchmarks/run.py --articles {articles} --tags {tags}",
+        pty=PTY,
+    )
+
+
 @task
 def black(c, check=False, diff=False):
     """Run Black auto-formatter, optionally with `--check` or `--diff`."""